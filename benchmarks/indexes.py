@@ -0,0 +1,91 @@
+"""Shows query plans and latencies of the hot lookups with and without the indexes of revision 3c9e4f1a7b2d.
+
+Seeds a large dataset on SQLite, measures at the current head, downgrades to the revision before the
+indexes and measures again.
+
+    $ python -m benchmarks.indexes
+"""
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from flask_migrate import downgrade
+from sqlalchemy import insert, text
+
+from benchmarks.utils import create_benchmark_app, seed_patients, MIGRATIONS
+from server.extensions import db
+from server.models.auth import RefreshToken, AccessToken
+from server.models.log import AccessLog
+
+TOKENS = 100000
+PATIENTS = 2000
+REPEAT = 20
+REVISION_WITHOUT_INDEXES = '56b37927bb2a'
+
+QUERIES = {
+    'refresh token by jti': ("SELECT id, blocked FROM refresh_token WHERE jti = :jti", {}),
+    'access token by jti': ("SELECT refresh_token.id, refresh_token.blocked FROM refresh_token "
+                            "JOIN access_token ON refresh_token.id = access_token.refresh_token_id "
+                            "WHERE access_token.jti = :access_jti", {}),
+    'expired access tokens': ("SELECT id FROM access_token WHERE expire_date < :now LIMIT 1000", {}),
+    'tokens of a user': ("SELECT id FROM refresh_token WHERE user_id = 2", {}),
+    'appointments of patients': ("SELECT id FROM appointment WHERE patient_id IN (10, 500, 1500)", {}),
+    'measures of appointments': ("SELECT id FROM measure WHERE appointment_id IN (10, 500, 1500)", {}),
+    'access log of an hour': ("SELECT count(*) FROM access_log WHERE timestamp BETWEEN :start AND :end", {}),
+}
+
+
+def seed_tokens_and_log(app, now: float):
+    with app.app_context():
+        # 1000 users, the newest rows expire first and only a few tokens are expired
+        refresh_rows = [{'id': index + 1, 'jti': str(uuid.uuid4()), 'blocked': False, 'user_id': 1 + index % 1000,
+                         'expire_date': now + TOKENS - index} for index in range(TOKENS)]
+        db.session.execute(insert(RefreshToken), refresh_rows)
+        db.session.execute(insert(AccessToken), [{'jti': str(uuid.uuid4()), 'refresh_token_id': row['id'],
+                                                  'expire_date': row['expire_date'] - 1000}
+                                                 for row in refresh_rows])
+        start = datetime.utcnow() - timedelta(days=30)
+        db.session.execute(insert(AccessLog), [{'path': '/api/patient/', 'method': 'GET', 'username': 'client',
+                                                'response_code': 200, 'remote_addr': '127.0.0.1',
+                                                'timestamp': start + timedelta(seconds=index * 10)}
+                                               for index in range(TOKENS)])
+        db.session.commit()
+        return refresh_rows[TOKENS // 2]['jti'], db.session.execute(
+            text("SELECT jti FROM access_token WHERE id = :id"), {'id': TOKENS // 2}).scalar(), start
+
+
+def measure(app, parameters: dict) -> dict:
+    results = {}
+    with app.app_context():
+        for name, (query, _) in QUERIES.items():
+            plan = db.session.execute(text(f"EXPLAIN QUERY PLAN {query}"), parameters).all()
+            start = time.perf_counter()
+            for _ in range(REPEAT):
+                db.session.execute(text(query), parameters).all()
+            results[name] = ((time.perf_counter() - start) / REPEAT, ' | '.join(row[-1] for row in plan))
+    return results
+
+
+def main() -> int:
+    app = create_benchmark_app()
+    now = datetime.utcnow().timestamp()
+    seed_patients(app, PATIENTS, 2, 5)
+    jti, access_jti, log_start = seed_tokens_and_log(app, now)
+    parameters = {'jti': jti, 'access_jti': access_jti, 'now': now,
+                  'start': log_start + timedelta(days=10), 'end': log_start + timedelta(days=10, hours=1)}
+
+    indexed = measure(app, parameters)
+    with app.app_context():
+        downgrade(directory=MIGRATIONS, revision=REVISION_WITHOUT_INDEXES)
+    plain = measure(app, parameters)
+
+    for name in QUERIES:
+        print(f"{name}")
+        print(f"    without indexes {plain[name][0] * 1000:8.3f}ms  {plain[name][1]}")
+        print(f"    with indexes    {indexed[name][0] * 1000:8.3f}ms  {indexed[name][1]}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
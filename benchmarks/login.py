@@ -0,0 +1,50 @@
+"""Measures login and refresh throughput with concurrent clients.
+
+Every thread gets a password verification slot (PASSWORD_HASH_CONCURRENCY), the throughput counts the
+successful requests only. Logins rejected as busy (429) are reported apart from other failures.
+
+    $ python -m benchmarks.login [threads]
+"""
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.utils import create_benchmark_app
+
+REQUESTS_PER_THREAD = 50
+
+
+def run(app, threads: int, request) -> [float, Counter]:
+    def worker(_):
+        client = app.test_client()
+        return Counter(request(client).status_code for _ in range(REQUESTS_PER_THREAD))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        status_codes = sum(executor.map(worker, range(threads)), Counter())
+    return time.perf_counter() - start, status_codes
+
+
+def main() -> int:
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    app = create_benchmark_app(PASSWORD_HASH_CONCURRENCY=threads)
+    client = app.test_client()
+    refresh_token = client.post('/api/auth/', json={'username': 'client', 'password': '123456'}).get_json()[
+        'refresh_token']
+    header = {'Authorization': f'Bearer {refresh_token}'}
+
+    requests = {'login': lambda c: c.post('/api/auth/', json={'username': 'client', 'password': '123456'}),
+                'refresh': lambda c: c.get('/api/auth/', headers=header)}
+    total = threads * REQUESTS_PER_THREAD
+    for name, request in requests.items():
+        duration, status_codes = run(app, threads, request)
+        succeeded, busy = status_codes[200], status_codes[429]
+        failed = total - succeeded - busy
+        print(f"{name:8} threads={threads} requests={total} busy={busy} failed={failed} "
+              f"{succeeded / duration:8.1f} req/s {duration / max(succeeded, 1) * 1000:8.2f}ms/req")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,50 @@
+"""Measures the throughput of the bulk measure ingestion endpoint.
+
+    $ python -m benchmarks.measure_ingest
+"""
+import json
+import sys
+from datetime import datetime
+
+from benchmarks.utils import create_benchmark_app, seed_patients, auth_header, timed
+
+APPOINTMENTS = 20
+MEASURES_PER_REQUEST = 20000
+REQUESTS = 5
+
+
+def main() -> int:
+    app = create_benchmark_app()
+    seed_patients(app, 10, APPOINTMENTS // 10, 0)
+    client = app.test_client()
+    header = auth_header(client)
+    now = datetime.utcnow().timestamp()
+
+    for content_type in ('application/json', 'application/x-ndjson'):
+        measures = [{'appointment_id': 2 + index % APPOINTMENTS, 'category': 'HR', 'value': 60 + index % 40,
+                     'timestamp': now + index, 'marker': 'HR'} for index in range(MEASURES_PER_REQUEST)]
+        if content_type == 'application/json':
+            body = json.dumps(measures)
+        else:
+            body = '\n'.join(json.dumps(measure) for measure in measures)
+
+        duration, response = timed(client.post, '/api/measure/bulk', data=body, repeat=REQUESTS,
+                                   headers={**header, 'Content-Type': content_type})
+        result = response.get_json()
+        if result['inserted'] != MEASURES_PER_REQUEST:
+            print(f"Not all measures inserted: {result['failed']} failed, first error {result['errors'][:1]}")
+            return 1
+        print(f"{content_type:22} {MEASURES_PER_REQUEST} measures/request  {duration * 1000:8.1f}ms  "
+              f"{MEASURES_PER_REQUEST / duration:10.0f} measures/s")
+
+    invalid = [{'appointment_id': 10 ** 9, 'category': 'HR', 'value': 1, 'timestamp': now},
+               {'appointment_id': 2, 'category': 'unknown', 'value': 1, 'timestamp': now},
+               {'appointment_id': 2, 'category_id': 1, 'value': 'x', 'timestamp': now},
+               {'appointment_id': 2, 'category_id': 1, 'value': 1, 'timestamp': '2024-01-01T10:00:00'}]
+    result = client.post('/api/measure/bulk', json=invalid, headers=header).get_json()
+    print(f"invalid rows: inserted={result['inserted']} errors={result['errors']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
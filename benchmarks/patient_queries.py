@@ -0,0 +1,45 @@
+"""Counts the SQL statements per patient request for growing datasets.
+
+The number of statements must not depend on the number of patients, appointments or
+measures. Exits with status 1 if it does. Selectin loading issues one statement per 500
+parent rows, the dataset stays below that so the count is exact.
+
+    $ python -m benchmarks.patient_queries
+"""
+import sys
+
+from benchmarks.utils import create_benchmark_app, seed_patients, auth_header, QueryCounter, timed
+
+# Patients, appointments per patient and measures per appointment added in each step
+STEPS = [(10, 2, 5), (150, 3, 10)]
+
+
+def main() -> int:
+    # The app factory registers the JWT callbacks once per process, so one app is grown step by step.
+    # Cached responses would run no statements at all, the patient response cache is disabled.
+    app = create_benchmark_app(PATIENT_CACHE_ENABLED=False)
+    client = app.test_client()
+    header = auth_header(client)
+
+    counts = {}
+    for step in STEPS:
+        seed_patients(app, *step)
+        # first request warms up caches (token cache)
+        client.get('/api/patient/1', headers=header)
+        for name, url in [('list', '/api/patient/'), ('detail', '/api/patient/2')]:
+            with QueryCounter(app) as counter:
+                duration, response = timed(client.get, url, headers=header)
+            assert response.status_code == 200, response.status_code
+            print(f"{name:6} +patients={step[0]:5} appointments={step[1]} measures={step[2]:3} "
+                  f"statements={counter.count:3} duration={duration * 1000:8.1f}ms")
+            counts.setdefault(name, set()).add(counter.count)
+
+    growing = [name for name, values in counts.items() if len(values) > 1]
+    if growing:
+        print(f"Statement count depends on the dataset size for: {', '.join(growing)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""Routes a mixed workload over a primary and a replica SQLite file and counts the statements per database.
+
+The replica is a copy of the seeded primary. Patients changed afterwards only exist on the primary, this
+shows which requests read from the replica and that writes and refreshes never do.
+
+    $ python -m benchmarks.replicas
+"""
+import os
+import shutil
+import tempfile
+
+from sqlalchemy import event
+
+from benchmarks.utils import create_benchmark_app, seed_patients, auth_header, timed
+from server.extensions import db, replica_router
+
+PATIENTS = 200
+REPEAT = 200
+
+
+def count_statements(engine, counts: dict, name: str):
+    def count(*args):
+        counts[name] += 1
+
+    event.listen(engine, 'before_cursor_execute', count)
+
+
+def main():
+    folder = tempfile.mkdtemp(prefix='flask_rest_replicas_')
+    primary, replica = os.path.join(folder, 'primary.db'), os.path.join(folder, 'replica.db')
+    app = create_benchmark_app(SQLALCHEMY_DATABASE_URI=f"sqlite:///{primary}",
+                               SQLALCHEMY_BINDS={'replica_0': f"sqlite:///{replica}"})
+    seed_patients(app, PATIENTS, 2, 5)
+    shutil.copy(primary, replica)
+
+    counts = {'primary': 0, 'replica': 0}
+    with app.app_context():
+        count_statements(db.engines[None], counts, 'primary')
+        count_statements(db.engines['replica_0'], counts, 'replica')
+
+    client = app.test_client()
+    headers = auth_header(client)
+    print(f"login: {counts}")
+
+    steps = {
+        'GET /api/patient/<id>': lambda: client.get('/api/patient/1', headers=headers),
+        'GET /api/patient/?limit=50': lambda: client.get('/api/patient/?limit=50', headers=headers),
+        'PUT /api/patient/<id>': lambda: client.put('/api/patient/2', headers=headers, json={'comments': 'x'}),
+    }
+    for name, step in steps.items():
+        before = dict(counts)
+        duration, response = timed(step, repeat=REPEAT)
+        print(f"{name:<28} {response.status_code}  {duration * 1000:6.2f} ms  "
+              f"primary {(counts['primary'] - before['primary']) / REPEAT:4.1f}  "
+              f"replica {(counts['replica'] - before['replica']) / REPEAT:4.1f} statements per request")
+
+    # The replica does not know the new patient, the primary serves the write
+    created = client.post('/api/patient/', headers=headers,
+                          json={'name': 'New', 'surname': 'Patient', 'birthday': '1990-01-01T00:00:00'})
+    lagging = client.get(f"/api/patient/{created.get_json()['id']}", headers=headers)
+    print(f"POST /api/patient/ {created.status_code}, GET of the new patient from the replica {lagging.status_code}")
+    print(f"reads per replica: {replica_router.reads}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Compares the per-patient serialization cost of flask_restful marshal and the compiled serializer.
+
+Both outputs are dumped to JSON and have to be byte-identical.
+
+    $ python -m benchmarks.serializer
+"""
+import json
+import sys
+
+from flask_restful import marshal
+
+from benchmarks.utils import create_benchmark_app, seed_patients, timed
+from server.models.main import Patient
+from server.serializer import compile_fields
+
+PATIENTS = 500
+APPOINTMENTS = 3
+MEASURES = 10
+REPEAT = 5
+
+
+def main() -> int:
+    app = create_benchmark_app()
+    seed_patients(app, PATIENTS, APPOINTMENTS, MEASURES)
+    patient_fields = Patient.get_fields()
+    serialize = compile_fields(patient_fields)
+
+    with app.app_context():
+        patients = Patient.query.order_by(Patient.id).all()
+
+        marshal_time, marshalled = timed(lambda: [marshal(patient, patient_fields) for patient in patients],
+                                         repeat=REPEAT)
+        compiled_time, compiled = timed(lambda: [serialize(patient) for patient in patients], repeat=REPEAT)
+
+    if json.dumps(marshalled) != json.dumps(compiled):
+        print("Compiled serializer output differs from marshal")
+        return 1
+
+    objects = len(patients)
+    print(f"patients={objects} appointments/patient={APPOINTMENTS} measures/appointment={MEASURES}")
+    print(f"marshal   {marshal_time / objects * 1e6:8.1f}us per patient")
+    print(f"compiled  {compiled_time / objects * 1e6:8.1f}us per patient ({marshal_time / compiled_time:.1f}x)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""Reports the import time per package and module and the duration of create_app.
+
+The app is created in a fresh interpreter started with -X importtime, as a worker without preload_app would.
+
+    $ python -m benchmarks.startup [--api-only] [--top 20]
+"""
+import argparse
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from dotenv import load_dotenv
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_CREATE_APP = """
+import time
+start = time.perf_counter()
+from server import create_app
+imported = time.perf_counter()
+create_app(api_only={api_only})
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+def profile(api_only: bool) -> [float, float, list]:
+    """Returns the import time, the create_app time (in seconds) and (module, self, cumulative) per import"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', _CREATE_APP.format(api_only=api_only)],
+                            capture_output=True, text=True, check=True, cwd=ROOT)
+    modules = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(own) / 1e6, int(cumulative) / 1e6))
+    import_time, create_time = map(float, result.stdout.split()[-2:])
+    return import_time, create_time, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--api-only', action='store_true', help="create the app without the user management")
+    parser.add_argument('--top', type=int, default=20, help="number of packages and modules to show")
+    args = parser.parse_args()
+
+    # server.config reads the environment on import
+    load_dotenv(os.path.join(ROOT, '.flaskenv'))
+    import_time, create_time, modules = profile(args.api_only)
+
+    packages = defaultdict(float)
+    for name, own, _ in modules:
+        packages[name.split('.')[0]] += own
+
+    print(f"import server: {import_time * 1000:8.1f} ms")
+    print(f"create_app:    {create_time * 1000:8.1f} ms")
+    print(f"modules:       {len(modules):8d}")
+    print(f"\nPackages by import time (self)")
+    for name, own in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"{own * 1000:8.1f} ms  {name}")
+    print(f"\nModules by import time (self)")
+    for name, own, cumulative in sorted(modules, key=lambda module: module[1], reverse=True)[:args.top]:
+        print(f"{own * 1000:8.1f} ms  {cumulative * 1000:8.1f} ms cumulative  {name}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+from flask import Flask
+from flask_migrate import upgrade
+from sqlalchemy import event, insert, text
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MIGRATIONS = os.path.join(ROOT, 'migrations')
+
+# server.config reads the environment on import
+load_dotenv(os.path.join(ROOT, '.flaskenv'))
+
+from server import create_app
+from server.extensions import db
+from server.models.main import Patient, Appointment, Measure
+
+
+def create_benchmark_app(**config) -> Flask:
+    """Creates an app on a fresh, migrated SQLite database in a temporary folder"""
+    folder = tempfile.mkdtemp(prefix='flask_rest_benchmark_')
+    test_config = {'SECRET_KEY': 'benchmark',
+                   'JWT_SECRET_KEY': 'benchmark-jwt-secret-key-of-sufficient-length',
+                   'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(folder, 'app.db')}",
+                   'TOKEN_CACHE_GENERATION_FILE': os.path.join(folder, 'token_cache.gen')}
+    test_config.update(config)
+    app = create_app(test_config)
+    with app.app_context():
+        upgrade(directory=MIGRATIONS)
+    return app
+
+
+def seed_patients(app: Flask, patients: int, appointments: int, measures: int):
+    """Adds patients, each with appointments which each hold measures of category 1"""
+    now = datetime.utcnow().timestamp()
+    with app.app_context():
+        first_patient = (db.session.query(db.func.max(Patient.id)).scalar() or 0) + 1
+        first_appointment = (db.session.query(db.func.max(Appointment.id)).scalar() or 0) + 1
+        patient_rows = [{'id': first_patient + p, 'name': f'Name {p}', 'surname': f'Surname {p}',
+                         '_birthday': now} for p in range(patients)]
+        appointment_rows = [{'id': first_appointment + p * appointments + a, 'patient_id': first_patient + p,
+                             '_date': now} for p in range(patients) for a in range(appointments)]
+        measure_rows = [{'appointment_id': appointment['id'], 'category_id': 1, 'marker': 'HR',
+                         'value': 60 + m, '_timestamp': now + m}
+                        for appointment in appointment_rows for m in range(measures)]
+        db.session.execute(insert(Patient), patient_rows)
+        if appointment_rows:
+            db.session.execute(insert(Appointment), appointment_rows)
+        if measure_rows:
+            db.session.execute(insert(Measure), measure_rows)
+        if db.engine.dialect.name == 'postgresql':
+            # The rows have explicit ids, the sequences have to continue after them
+            for table in ('patient', 'appointment'):
+                db.session.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                                        f"(SELECT max(id) FROM {table}))"))
+        db.session.commit()
+
+
+def auth_header(client, username: str = 'client', password: str = '123456') -> dict:
+    response = client.post('/api/auth/', json={'username': username, 'password': password})
+    return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+
+class QueryCounter:
+    """Counts the SQL statements executed on the engine of an app while active"""
+
+    def __init__(self, app: Flask):
+        with app.app_context():
+            self.engine = db.engine
+        self.statements = []
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        self.statements = []
+        event.listen(self.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+
+def timed(function, *args, repeat: int = 1, **kwargs) -> [float, object]:
+    """Returns the mean duration in seconds of calling function and its last result"""
+    result = None
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function(*args, **kwargs)
+    return (time.perf_counter() - start) / repeat, result
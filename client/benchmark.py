@@ -0,0 +1,239 @@
+"""Load test of the API: login, refresh and patient CRUD and list with concurrent clients.
+
+Every endpoint is measured in its own phase, the report holds the p50/p95/p99 latency (in milliseconds) and the
+throughput (requests per second) per endpoint. Without --url the app is started with gunicorn on a temporary SQLite
+database (or --database, e.g. a local Postgres), migrated and seeded with --patients patients.
+
+    $ python client/benchmark.py --concurrency 8 --requests 500 --output before.json
+    $ python client/benchmark.py --concurrency 8 --requests 500 --output after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+from dotenv import dotenv_values
+
+from login import Client
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_SEED = """
+import sys
+from benchmarks.utils import seed_patients
+from server import create_app
+seed_patients(create_app(api_only=True), int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3]))
+"""
+
+
+class LocalServer:
+    """Runs the app with gunicorn on a migrated and seeded database while the context is active"""
+
+    def __init__(self, database: str = None, workers: int = 2, patients: int = 1000, appointments: int = 2,
+                 measures: int = 5):
+        self.database = database
+        self.workers = workers
+        self.patients = patients
+        self.appointments = appointments
+        self.measures = measures
+        self.folder = tempfile.mkdtemp(prefix='flask_rest_load_')
+        self.process = None
+        self.log = None
+
+    def __enter__(self) -> str:
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        env = {**os.environ, **dotenv_values(os.path.join(ROOT, '.flaskenv'))}
+        env.update(SQLALCHEMY_DATABASE_URI=self.database or f"sqlite:///{os.path.join(self.folder, 'app.db')}",
+                   TOKEN_CACHE_GENERATION_FILE=os.path.join(self.folder, 'token_cache.gen'),
+                   PATIENT_CACHE_GENERATION_FILE=os.path.join(self.folder, 'patient_cache.gen'),
+                   # Tokens stay valid for the whole run
+                   JWT_ACCESS_TOKEN_EXPIRES='600')
+        subprocess.run([sys.executable, '-m', 'flask', 'db', 'upgrade'], cwd=ROOT, env=env, check=True,
+                       capture_output=True)
+        if self.patients:
+            subprocess.run([sys.executable, '-c', _SEED, str(self.patients), str(self.appointments),
+                            str(self.measures)], cwd=ROOT, env=env, check=True, capture_output=True)
+
+        env.update(API_ONLY='1', GUNICORN_BIND=f'127.0.0.1:{port}', GUNICORN_WORKERS=str(self.workers))
+        self.log = open(os.path.join(self.folder, 'gunicorn.log'), 'w')
+        self.process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'], cwd=ROOT,
+                                        env=env, stdout=self.log, stderr=subprocess.STDOUT)
+        base_url = f'http://127.0.0.1:{port}/api/'
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                requests.get(base_url + 'patient/', timeout=1)
+                return base_url
+            except requests.ConnectionError:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"The server did not start, see {self.log.name}")
+                time.sleep(0.1)
+
+    def __exit__(self, *args):
+        self.process.terminate()
+        self.process.wait()
+        self.log.close()
+
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    return values[max(int(-(-q * len(values) // 100)) - 1, 0)]
+
+
+def run_phase(base_url: str, concurrency: int, count: int, call) -> dict:
+    """Calls call(client, index) count times from concurrency threads, each thread uses its own client"""
+    local = threading.local()
+    clients = []
+
+    def task(index):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = Client(base_url, pool_size=1)
+            clients.append(client)
+        start = time.perf_counter()
+        try:
+            status = call(client, index).status_code
+        except requests.RequestException:
+            status = 'error'
+        return time.perf_counter() - start, status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(task, range(count)))
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        client.close()
+
+    latencies = sorted(duration * 1000 for duration, _ in results)
+    statuses = Counter(str(status) for _, status in results)
+    return {'requests': count,
+            'errors': sum(number for status, number in statuses.items() if not status.startswith('2')),
+            'status': dict(statuses),
+            'throughput': count / elapsed if elapsed else 0.0,
+            'mean': sum(latencies) / len(latencies) if latencies else 0.0,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': latencies[-1] if latencies else 0.0}
+
+
+def run(base_url: str, concurrency: int, count: int, patients: int) -> dict:
+    client = Client(base_url)
+    tokens = client.login().json()
+    access_token, refresh_token = tokens['access_token'], tokens['refresh_token']
+    created = []
+
+    def create(c, index):
+        response = c.add_patient(access_token)
+        if response.status_code == 200:
+            created.append(response.json()['id'])
+        return response
+
+    def get(c, index):
+        return c.get_patient(access_token, random.randint(1, patients) if patients else created[index % len(created)])
+
+    # Phases in order, update and delete use the patients of create
+    phases = [('login', count, lambda c, index: c.login()),
+              ('refresh', count, lambda c, index: c.refresh_login(refresh_token)),
+              ('create', count, create),
+              ('get', count, get),
+              ('list', count, lambda c, index: c.get_patients(access_token, limit=50)),
+              ('update', count, lambda c, index: c.update_patient(access_token, f"Name {index}",
+                                                                  id=created[index % len(created)])),
+              ('delete', None, lambda c, index: c.delete_patient(access_token, created[index]))]
+    endpoints = {}
+    for name, number, call in phases:
+        endpoints[name] = run_phase(base_url, concurrency, len(created) if number is None else number, call)
+        print_result(name, endpoints[name])
+        if name == 'create' and not created:
+            raise RuntimeError(f"No patient could be created: {endpoints[name]['status']}")
+    client.logout(refresh_token)
+    client.close()
+    return endpoints
+
+
+def print_result(name: str, result: dict):
+    print(f"{name:<8} {result['requests']:>6} requests {result['errors']:>5} errors "
+          f"{result['throughput']:8.1f} req/s  p50 {result['p50']:7.2f}  p95 {result['p95']:7.2f}  "
+          f"p99 {result['p99']:7.2f} ms", flush=True)
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """Endpoints whose p95 latency or throughput got worse than the baseline by more than tolerance"""
+    regressions = []
+    for name, result in report['endpoints'].items():
+        old = baseline.get('endpoints', {}).get(name)
+        if not old or not old['p95'] or not old['throughput']:
+            continue
+        p95 = result['p95'] / old['p95'] - 1
+        throughput = result['throughput'] / old['throughput'] - 1
+        regressed = p95 > tolerance or throughput < -tolerance
+        print(f"{name:<8} p95 {p95:+7.1%}  throughput {throughput:+7.1%}{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load test of the API")
+    parser.add_argument('--url', help="API of a running server (e.g. http://localhost:5000/api/), "
+                                      "otherwise a local server is started")
+    parser.add_argument('--database', help="Database uri of the local server (default: temporary SQLite file)")
+    parser.add_argument('--workers', type=int, default=2, help="Gunicorn workers of the local server")
+    parser.add_argument('--patients', type=int, default=1000, help="Patients seeded into the local database")
+    parser.add_argument('--concurrency', type=int, default=8, help="Concurrent clients")
+    parser.add_argument('--requests', type=int, default=500, help="Requests per endpoint")
+    parser.add_argument('--output', default='benchmark.json', help="JSON report")
+    parser.add_argument('--compare', help="JSON report of a previous run")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Allowed increase of p95 and decrease of throughput compared to --compare")
+    args = parser.parse_args()
+
+    meta = {'commit': commit(), 'date': datetime.now().isoformat(), 'python': platform.python_version(),
+            'concurrency': args.concurrency, 'requests': args.requests}
+    if args.url:
+        meta.update(url=args.url, patients=None)
+        endpoints = run(args.url, args.concurrency, args.requests, 0)
+    else:
+        meta.update(database=args.database or 'sqlite', workers=args.workers, patients=args.patients)
+        with LocalServer(args.database, args.workers, args.patients) as base_url:
+            endpoints = run(base_url, args.concurrency, args.requests, args.patients)
+
+    report = {'meta': meta, 'endpoints': endpoints}
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if compare(report, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,96 +1,109 @@
-import json
+import sys
 import time
 from datetime import datetime
 
 import requests
+from requests.adapters import HTTPAdapter
 
 BASE_URL = "http://localhost:5000/api/"
 BASE_HEADER = {"Content-Type": "application/json"}
 
 
-def _prepare_header(token):
-    header = BASE_HEADER.copy()
-    header["Authorization"] = f"Bearer {token}"
-    return header
+class Client:
+    """Client of the API, all calls share the connections of one requests session (keep-alive)"""
 
+    def __init__(self, base_url: str = BASE_URL, pool_size: int = 10):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.session.headers.update(BASE_HEADER)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Authorization headers by token
+        self._headers = {}
 
-def login() -> [str, str]:
-    login_data = {"username": "client", "password": "123456"}
-    response = requests.post(BASE_URL + "auth/", data=json.dumps(login_data), headers=BASE_HEADER)
-    return response
+    def _prepare_header(self, token: str) -> dict:
+        header = self._headers.get(token)
+        if header is None:
+            header = self._headers[token] = {"Authorization": f"Bearer {token}"}
+        return header
 
+    def close(self):
+        self.session.close()
 
-def refresh_login(refresh_token: str):
-    response = requests.get(BASE_URL + "auth/", headers=_prepare_header(refresh_token))
-    return response
+    def login(self, username: str = "client", password: str = "123456") -> requests.Response:
+        login_data = {"username": username, "password": password}
+        return self.session.post(self.base_url + "auth/", json=login_data)
 
+    def refresh_login(self, refresh_token: str) -> requests.Response:
+        return self.session.get(self.base_url + "auth/", headers=self._prepare_header(refresh_token))
 
-def get_patients(access_token: str) -> [dict, str]:
-    response = requests.get(BASE_URL + "patient/", headers=_prepare_header(access_token))
-    return response
+    def get_patients(self, access_token: str, **params) -> requests.Response:
+        return self.session.get(self.base_url + "patient/", params=params,
+                                headers=self._prepare_header(access_token))
 
+    def get_patient(self, access_token: str, id) -> requests.Response:
+        return self.session.get(self.base_url + "patient/" + str(id), headers=self._prepare_header(access_token))
 
-def update_patient(access_token: str, name) -> [dict, str]:
-    data = {"name": name}
-    response = requests.put(BASE_URL + "patient/1", data=json.dumps(data), headers=_prepare_header(access_token))
-    return response
+    def update_patient(self, access_token: str, name, id=1) -> requests.Response:
+        data = {"name": name}
+        return self.session.put(self.base_url + "patient/" + str(id), json=data,
+                                headers=self._prepare_header(access_token))
 
+    def delete_patient(self, access_token: str, id) -> requests.Response:
+        return self.session.delete(self.base_url + "patient/" + str(id), headers=self._prepare_header(access_token))
 
-def delete_patient(access_token: str, id) -> [dict, str]:
-    response = requests.delete(BASE_URL + "patient/" + str(id), headers=_prepare_header(access_token))
-    return response
+    def add_patient(self, access_token: str) -> requests.Response:
+        date = datetime(1971, 7, 30).isoformat()
+        data = {"name": "Hans", "surname": "Meier", "birthday": date}
+        return self.session.post(self.base_url + "patient/", json=data, headers=self._prepare_header(access_token))
 
+    def logout(self, refresh_token: str) -> requests.Response:
+        return self.session.delete(self.base_url + "auth/", headers=self._prepare_header(refresh_token))
 
-def add_patient(access_token: str) -> [dict, str]:
-    date = datetime(1971, 7, 30).isoformat()
-    data = {"name": "Hans", "surname": "Meier", "birthday": date}
-    response = requests.post(BASE_URL + "patient/", data=json.dumps(data), headers=_prepare_header(access_token))
-    return response
 
-
-def logout(refresh_token: str):
-    response = requests.delete(BASE_URL + "auth/", headers=_prepare_header(refresh_token))
-    return response
-
-
-def main():
-    response = login()
+def main(expiry_wait: float = 0):
+    client = Client()
+    response = client.login()
     access_token = response.json()["access_token"]
     refresh_token = response.json()["refresh_token"]
     print(f"login: {response.json()}")
 
-    response = get_patients(access_token)
+    response = client.get_patients(access_token)
     print(f"patients: {response.json()}")
 
-    time.sleep(18)
-
-    response = get_patients(access_token)
-    print(f"patients: {response.json()}")
+    if expiry_wait:
+        # Waits until the access token expired (JWT_ACCESS_TOKEN_EXPIRES)
+        time.sleep(expiry_wait)
+        response = client.get_patients(access_token)
+        print(f"patients: {response.json()}")
 
-    response = refresh_login(refresh_token)
+    response = client.refresh_login(refresh_token)
     access_token = response.json()["access_token"]
     print(f"refresh: {response.json()}")
 
-    response = update_patient(access_token, "Harald")
+    response = client.update_patient(access_token, "Harald")
     print(f"update: {response.json()}")
 
-    response = add_patient(access_token)
+    response = client.add_patient(access_token)
 
     patient_id = response.json()['id']
     print(f"add: {response.json()}")
 
-    response = get_patients(access_token)
+    response = client.get_patients(access_token)
     print(f"patients: {response.json()}")
 
-    response = delete_patient(access_token, patient_id)
+    response = client.delete_patient(access_token, patient_id)
     print(f"delete: {response.json()}")
 
-    response = update_patient(access_token, "Luca")
+    response = client.update_patient(access_token, "Luca")
     print(f"update: {response.json()}")
 
-    response = logout(refresh_token)
+    response = client.logout(refresh_token)
     print(f"logout: {response.json()}")
+    client.close()
 
 
 if __name__ == "__main__":
-    main()
+    # python client/login.py [seconds to wait for the access token to expire, e.g. 18]
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 0)
@@ -0,0 +1,31 @@
+# Gunicorn settings, used by the Docker image: gunicorn -c gunicorn.conf.py
+import os
+import shutil
+
+wsgi_app = 'server:create_app()'
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', 4))
+
+# Import and create the app once in the master, the workers share its memory copy-on-write and start faster.
+# The scheduler then runs in the master only, one token clean-up per container.
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') not in ('0', 'false', 'False')
+
+# Prometheus values of all workers are added up from mmap files in this folder, files of a previous run are
+# removed before the app is loaded
+metrics_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+if metrics_dir:
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+    # Imported here, child_exit runs in a signal handler
+    from prometheus_client import multiprocess
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from server import after_fork
+        after_fork(server.app.wsgi())
+
+
+def child_exit(server, worker):
+    if metrics_dir:
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,65 @@
+"""Index hot lookup columns
+
+Revision ID: 3c9e4f1a7b2d
+Revises: 56b37927bb2a
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9e4f1a7b2d'
+down_revision = '56b37927bb2a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # jti identifies a token, the indexes are recreated as unique
+    with op.batch_alter_table('access_token', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_access_token_jti'))
+        batch_op.create_index(batch_op.f('ix_access_token_jti'), ['jti'], unique=True)
+        batch_op.create_index(batch_op.f('ix_access_token_expire_date'), ['expire_date'], unique=False)
+        batch_op.create_index(batch_op.f('ix_access_token_refresh_token_id'), ['refresh_token_id'], unique=False)
+
+    with op.batch_alter_table('refresh_token', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_refresh_token_jti'))
+        batch_op.create_index(batch_op.f('ix_refresh_token_jti'), ['jti'], unique=True)
+        batch_op.create_index(batch_op.f('ix_refresh_token_expire_date'), ['expire_date'], unique=False)
+        batch_op.create_index(batch_op.f('ix_refresh_token_user_id'), ['user_id'], unique=False)
+
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_appointment_patient_id'), ['patient_id'], unique=False)
+
+    with op.batch_alter_table('measure', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_measure_appointment_id'), ['appointment_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_measure_category_id'), ['category_id'], unique=False)
+
+    with op.batch_alter_table('access_log', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_access_log_timestamp'), ['timestamp'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('access_log', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_access_log_timestamp'))
+
+    with op.batch_alter_table('measure', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_measure_category_id'))
+        batch_op.drop_index(batch_op.f('ix_measure_appointment_id'))
+
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_appointment_patient_id'))
+
+    with op.batch_alter_table('refresh_token', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_refresh_token_user_id'))
+        batch_op.drop_index(batch_op.f('ix_refresh_token_expire_date'))
+        batch_op.drop_index(batch_op.f('ix_refresh_token_jti'))
+        batch_op.create_index(batch_op.f('ix_refresh_token_jti'), ['jti'], unique=False)
+
+    with op.batch_alter_table('access_token', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_access_token_refresh_token_id'))
+        batch_op.drop_index(batch_op.f('ix_access_token_expire_date'))
+        batch_op.drop_index(batch_op.f('ix_access_token_jti'))
+        batch_op.create_index(batch_op.f('ix_access_token_jti'), ['jti'], unique=False)
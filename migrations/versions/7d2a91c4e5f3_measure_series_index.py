@@ -0,0 +1,31 @@
+"""Measure series index
+
+Revision ID: 7d2a91c4e5f3
+Revises: 3c9e4f1a7b2d
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2a91c4e5f3'
+down_revision = '3c9e4f1a7b2d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The series of one category of an appointment is read in timestamp order, the index starts with
+    # appointment_id and replaces the single column index. Postgres stores the value in the index as well.
+    with op.batch_alter_table('measure', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_measure_appointment_id'))
+        batch_op.create_index('ix_measure_series', ['appointment_id', 'category_id', '_timestamp'], unique=False,
+                              postgresql_include=['value'])
+
+
+def downgrade():
+    with op.batch_alter_table('measure', schema=None) as batch_op:
+        batch_op.drop_index('ix_measure_series')
+        batch_op.create_index(batch_op.f('ix_measure_appointment_id'), ['appointment_id'], unique=False)
@@ -0,0 +1,29 @@
+"""Refresh token user expiry index
+
+Revision ID: b5e8d2c7a1f4
+Revises: 7d2a91c4e5f3
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e8d2c7a1f4'
+down_revision = '7d2a91c4e5f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The tokens of a user are listed by expiry, the index starts with user_id and replaces the single column index
+    with op.batch_alter_table('refresh_token', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_refresh_token_user_id'))
+        batch_op.create_index('ix_refresh_token_user_expiry', ['user_id', 'expire_date'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('refresh_token', schema=None) as batch_op:
+        batch_op.drop_index('ix_refresh_token_user_expiry')
+        batch_op.create_index(batch_op.f('ix_refresh_token_user_id'), ['user_id'], unique=False)
@@ -0,0 +1,27 @@
+"""Refresh token issued_at
+
+Revision ID: c81f4a2d9b6e
+Revises: b5e8d2c7a1f4
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c81f4a2d9b6e'
+down_revision = 'b5e8d2c7a1f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Tokens can be revoked by issue time, existing tokens keep NULL and are matched by their expiry
+    with op.batch_alter_table('refresh_token', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('issued_at', sa.Double(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('refresh_token', schema=None) as batch_op:
+        batch_op.drop_column('issued_at')
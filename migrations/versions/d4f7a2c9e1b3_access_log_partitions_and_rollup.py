@@ -0,0 +1,78 @@
+"""Access log partitions and rollup
+
+Revision ID: d4f7a2c9e1b3
+Revises: c81f4a2d9b6e
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from datetime import datetime, timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4f7a2c9e1b3'
+down_revision = 'c81f4a2d9b6e'
+branch_labels = None
+depends_on = None
+
+_COLUMNS = """
+    path VARCHAR(128) NOT NULL,
+    method VARCHAR(10) NOT NULL,
+    username VARCHAR(36) NOT NULL,
+    response_code INTEGER NOT NULL,
+    remote_addr VARCHAR(36) NOT NULL,
+    "timestamp" TIMESTAMP WITHOUT TIME ZONE NOT NULL"""
+
+
+def upgrade():
+    op.create_table('access_log_rollup',
+    sa.Column('minute', sa.DateTime(), nullable=False),
+    sa.Column('path', sa.String(length=128), nullable=False),
+    sa.Column('method', sa.String(length=10), nullable=False),
+    sa.Column('response_code', sa.Integer(), nullable=False),
+    sa.Column('username', sa.String(length=36), nullable=False),
+    sa.Column('requests', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('minute', 'path', 'method', 'response_code', 'username')
+    )
+    if op.get_bind().dialect.name != 'postgresql':
+        # SQLite rotates the table (server.log_storage), its schema stays the same
+        return
+
+    # The existing rows become the first partition up to the end of the day, the maintenance job creates the
+    # following ones. The primary key of a partitioned table has to contain the partition key.
+    end = (datetime.utcnow() + timedelta(days=1)).strftime('%Y-%m-%d 00:00:00')
+    op.execute('ALTER TABLE access_log RENAME TO access_log_legacy')
+    op.execute('ALTER TABLE access_log_legacy RENAME CONSTRAINT access_log_pkey TO access_log_legacy_pkey')
+    op.execute('ALTER INDEX ix_access_log_timestamp RENAME TO ix_access_log_legacy_timestamp')
+    op.execute(f"""CREATE TABLE access_log (
+    id INTEGER NOT NULL DEFAULT nextval('access_log_id_seq'),{_COLUMNS},
+    CONSTRAINT access_log_pkey PRIMARY KEY (id, "timestamp")
+    ) PARTITION BY RANGE ("timestamp")""")
+    # The sequence would be dropped with the legacy partition otherwise
+    op.execute('ALTER SEQUENCE access_log_id_seq OWNED BY access_log.id')
+    op.execute('CREATE INDEX ix_access_log_timestamp ON access_log ("timestamp")')
+    op.execute(f"ALTER TABLE access_log ATTACH PARTITION access_log_legacy FOR VALUES FROM (MINVALUE) TO ('{end}')")
+    # Takes the records written before the maintenance job created their partition
+    op.execute('CREATE TABLE access_log_default PARTITION OF access_log DEFAULT')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('ALTER SEQUENCE access_log_id_seq OWNED BY NONE')
+        op.execute('ALTER TABLE access_log RENAME TO access_log_partitioned')
+        op.execute('ALTER TABLE access_log_partitioned RENAME CONSTRAINT access_log_pkey '
+                   'TO access_log_partitioned_pkey')
+        op.execute('ALTER INDEX ix_access_log_timestamp RENAME TO ix_access_log_partitioned_timestamp')
+        op.execute(f"""CREATE TABLE access_log (
+        id INTEGER NOT NULL DEFAULT nextval('access_log_id_seq'),{_COLUMNS},
+        CONSTRAINT access_log_pkey PRIMARY KEY (id)
+        )""")
+        op.execute('INSERT INTO access_log SELECT * FROM access_log_partitioned')
+        op.execute('DROP TABLE access_log_partitioned')
+        op.execute('ALTER SEQUENCE access_log_id_seq OWNED BY access_log.id')
+        op.execute('CREATE INDEX ix_access_log_timestamp ON access_log ("timestamp")')
+    # Rotated SQLite tables are kept
+
+    op.drop_table('access_log_rollup')
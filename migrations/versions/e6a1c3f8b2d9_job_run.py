@@ -0,0 +1,28 @@
+"""Job run
+
+Revision ID: e6a1c3f8b2d9
+Revises: d4f7a2c9e1b3
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6a1c3f8b2d9'
+down_revision = 'd4f7a2c9e1b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job_run',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('last_run', sa.Double(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('job_run')
@@ -1,19 +1,22 @@
+import os
 from datetime import datetime
 
 from flask import Flask, has_request_context, request
 from flask_jwt_extended import JWTManager
-from flask_login import LoginManager
-from flask_migrate import Migrate
 from flask_scheduler import Scheduler
 
 import server.extensions as extensions
+import server.tasks as tasks
+from server.access_log import AccessLogWriter
 from server.config import Config
+from server.pool import init_pool
 from server.models.auth import Role, User, RefreshToken, AccessToken
 from server.models.log import AccessLog
 from server.utils import get_current_user
 
 
-def create_app(test_config=None) -> Flask:
+def create_app(test_config=None, api_only: bool = None) -> Flask:
+    """Creates the app, with api_only (or API_ONLY) the user management web pages are not loaded"""
     app = Flask(__name__)
 
     # Initialize local configs in environment
@@ -21,10 +24,13 @@ def create_app(test_config=None) -> Flask:
         app.config.from_object(Config)
     else:
         app.config.from_mapping(test_config)
+    if api_only is not None:
+        app.config['API_ONLY'] = api_only
 
     # Init all
     init_extensions(app)
     register_blueprints(app)
+    register_commands(app)
     init_schedules(app)
     init_access_log(app)
 
@@ -33,19 +39,34 @@ def create_app(test_config=None) -> Flask:
 
 # Initialize Flask extensions
 def init_extensions(app):
+    init_pool(app)
     extensions.db.init_app(app)
-    extensions.migration = Migrate(app, extensions.db)
-    extensions.login_manager = LoginManager(app)  # flask-login extension for user-management authentication
-    extensions.login_manager.login_view = 'user_mng.login'
+    extensions.replica_router.init_app(app)
+    extensions.token_cache.init_app(app)
+    extensions.user_cache.init_app(app)
+    extensions.patient_cache.init_app(app)
+    extensions.password_hasher.init_app(app)
+    extensions.metrics.init_app(app)
+    extensions.profiler.init_app(app)
+    # Flask-Migrate imports alembic, API-only workers only load it for the flask command (flask db upgrade)
+    if not app.config.get('API_ONLY') or os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+        from flask_migrate import Migrate
+        extensions.migration = Migrate(app, extensions.db)
+    if not app.config.get('API_ONLY'):
+        from flask_login import LoginManager
+        extensions.login_manager = LoginManager(app)  # flask-login extension for user-management authentication
+        extensions.login_manager.login_view = 'user_mng.login'
     extensions.jwt = JWTManager(app)
     extensions.scheduler = Scheduler(app)
+    extensions.access_log = AccessLogWriter(app)
 
 
 def register_blueprints(app):
     # Register blueprints for different modules
-    # user-management web page
-    from server.user_mng import bp as user_mng_bp
-    app.register_blueprint(user_mng_bp, url_prefix='/')
+    # user-management web page (with wtforms and templates), not needed by API-only workers
+    if not app.config.get('API_ONLY'):
+        from server.user_mng import bp as user_mng_bp
+        app.register_blueprint(user_mng_bp, url_prefix='/')
     # user login apis
     from server.auth import bp as api_auth_bp
     app.register_blueprint(api_auth_bp, url_prefix='/api/auth')
@@ -54,16 +75,23 @@ def register_blueprints(app):
     app.register_blueprint(main_bp, url_prefix='/api')
 
 
+def register_commands(app):
+    # flask revoke-tokens
+    from server.auth.commands import revoke_tokens_command
+    app.cli.add_command(revoke_tokens_command)
+
+
 def init_access_log(app):
     @app.after_request
     def log_after_request(response):
+        # Scrapes of /metrics are not logged
+        if has_request_context() and request.endpoint == 'metrics':
+            return response
         url = "Not available"
         remote_addr = "Not available"
         method = "Not available"
         if has_request_context():
             url = request.url
-            for key in request.environ.keys():
-                print(f"{key}: {request.environ[key]}")
             if 'X-Envoy-External-Address' in request.headers:
                 remote_addr = request.headers.get('X-Envoy-External-Address')
             else:
@@ -71,27 +99,34 @@ def init_access_log(app):
             method = request.method
         current_user = get_current_user()
         status_code = response.status_code
-        access_log = AccessLog(path=url,
-                               remote_addr=remote_addr,
-                               response_code=status_code,
-                               username=current_user,
-                               method=method)
-        extensions.db.session.add(access_log)
-        extensions.db.session.commit()
+        # Records are written in batches by the access log writer, values are cut to the column sizes
+        extensions.access_log.log({'path': url[:AccessLog.path.type.length],
+                                   'remote_addr': (remote_addr or "")[:AccessLog.remote_addr.type.length],
+                                   'response_code': status_code,
+                                   'username': current_user[:AccessLog.username.type.length],
+                                   'method': method[:AccessLog.method.type.length],
+                                   'timestamp': datetime.utcnow()})
         return response
 
 
 def init_schedules(app):
-    # Schedule delete tokens
-    @extensions.scheduler.runner(interval=60)
+    # Schedule delete tokens, every worker schedules the job but only one at a time runs it
+    @extensions.scheduler.runner(interval=app.config.get('TOKEN_CLEANUP_INTERVAL', 60))
     def clear_expired_tokens():
-        with app.app_context():
-            expired_tokens = RefreshToken.query.filter(RefreshToken.expire_date < datetime.utcnow().timestamp()).all()
-            expired_tokens += AccessToken.query.filter(AccessToken.expire_date < datetime.utcnow().timestamp()).all()
-            for expired_token in expired_tokens:
-                extensions.db.session.delete(expired_token)
+        tasks.clear_expired_tokens(app)
+
+    # Partitions or table rotation and retention of the access log, only one worker at a time runs it
+    @extensions.scheduler.runner(interval=app.config.get('ACCESS_LOG_MAINTENANCE_INTERVAL', 3600))
+    def maintain_access_log():
+        tasks.maintain_access_log(app)
+
 
-            extensions.db.session.commit()
+def after_fork(app):
+    """Has to be called in every worker forked from a process which already created the app (preload_app)"""
+    # The pooled connections belong to the parent, close=False leaves them open for it
+    with app.app_context():
+        for engine in extensions.db.engines.values():
+            engine.dispose(close=False)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,141 @@
+import atexit
+import os
+import queue
+import threading
+import time
+
+from flask import Flask
+from sqlalchemy import insert
+
+from server.extensions import db
+from server.log_storage import rollup_rows, rollup_upsert
+from server.models.log import AccessLog
+
+_STOP = object()
+
+
+class AccessLogWriter:
+    """Buffers access log records and writes them in batches from a background thread.
+
+    Requests only put a record into a bounded queue. If the queue is full the record is
+    dropped (after an optional short wait) so that logging never stalls request handling.
+    The per-minute rollups are updated in the transaction of each batch.
+    """
+
+    def __init__(self, app: Flask = None):
+        self.app = None
+        self.queue_size = 10000
+        self.batch_size = 500
+        self.flush_interval = 1.0
+        self.put_timeout = 0.0
+        self.rollup = True
+        # counters
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.max_depth = 0
+
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._rollup_upsert = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask):
+        app.config.setdefault('ACCESS_LOG_QUEUE_SIZE', 10000)
+        app.config.setdefault('ACCESS_LOG_BATCH_SIZE', 500)
+        # in milliseconds
+        app.config.setdefault('ACCESS_LOG_FLUSH_INTERVAL', 1000)
+        app.config.setdefault('ACCESS_LOG_PUT_TIMEOUT', 0)
+        app.config.setdefault('ACCESS_LOG_ROLLUP_ENABLED', True)
+
+        self.app = app
+        self.queue_size = int(app.config['ACCESS_LOG_QUEUE_SIZE'])
+        self.batch_size = int(app.config['ACCESS_LOG_BATCH_SIZE'])
+        self.flush_interval = float(app.config['ACCESS_LOG_FLUSH_INTERVAL']) / 1000
+        self.put_timeout = float(app.config['ACCESS_LOG_PUT_TIMEOUT']) / 1000
+        self.rollup = bool(app.config['ACCESS_LOG_ROLLUP_ENABLED'])
+        app.extensions['access_log'] = self
+        atexit.register(self.stop)
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def log(self, record: dict) -> bool:
+        self._ensure_started()
+        try:
+            self._queue.put(record, block=self.put_timeout > 0, timeout=self.put_timeout or None)
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+        self.enqueued += 1
+        depth = self._queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    def stop(self, timeout: float = 5.0):
+        # Only the process which started the writer can drain it
+        if self._thread is None or self._pid != os.getpid():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            self.app.logger.warning("Access log queue full on shutdown, %d records lost", self.depth)
+            return
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _ensure_started(self):
+        # The writer is started lazily so every (forked) worker gets its own queue and thread
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._thread = threading.Thread(target=self._run, name='access-log-writer', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                record = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                record = None
+
+            if record is _STOP:
+                self._flush(batch)
+                return
+            if record is not None:
+                batch.append(record)
+
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._flush(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _flush(self, batch: list):
+        if not batch:
+            return
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as connection:
+                    connection.execute(insert(AccessLog), batch)
+                    if self.rollup:
+                        if self._rollup_upsert is None:
+                            self._rollup_upsert = rollup_upsert(connection.dialect.name)
+                        if self._rollup_upsert is not None:
+                            connection.execute(self._rollup_upsert, rollup_rows(batch))
+            self.written += len(batch)
+        except Exception:
+            self.failed += len(batch)
+            self.app.logger.exception("Could not write %d access log records", len(batch))
@@ -0,0 +1,40 @@
+import click
+from flask.cli import with_appcontext
+
+from server.auth.utils import revoke_tokens
+from server.models.auth import User
+from server.utils import parse_timestamp
+
+
+def _parse_time(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return parse_timestamp(value)
+
+
+@click.command('revoke-tokens')
+@click.option('--user', 'username', help="Revoke the tokens of this user")
+@click.option('--issued-before', help="Revoke tokens issued before this ISO date or unix timestamp")
+@click.option('--all', 'revoke_all', is_flag=True, help="Revoke the tokens of all users")
+@with_appcontext
+def revoke_tokens_command(username, issued_before, revoke_all):
+    """Blocks refresh tokens and their access tokens with one UPDATE, e.g. flask revoke-tokens --user client"""
+    if not (username or issued_before or revoke_all):
+        raise click.UsageError("Pass --user, --issued-before or --all")
+
+    user_id = None
+    if username:
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            raise click.BadParameter(f"Unknown user {username}", param_hint='--user')
+        user_id = user.id
+    timestamp = None
+    if issued_before:
+        try:
+            timestamp = _parse_time(issued_before)
+        except ValueError:
+            raise click.BadParameter(f"{issued_before} is no ISO date or unix timestamp", param_hint='--issued-before')
+
+    blocked = revoke_tokens(user_id=user_id, issued_before=timestamp)
+    click.echo(f"{blocked} tokens blocked")
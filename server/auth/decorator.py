@@ -2,27 +2,24 @@ from functools import wraps
 from typing import List
 
 from flask import abort
-from flask_jwt_extended import get_jwt_identity
-
-from server.models.auth import User
+from flask_jwt_extended import get_jwt, get_current_user
 
 
 def role_required(roles: List):
+    required_roles = frozenset(roles)
+
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            current_user = get_jwt_identity()
-            user = User.query.get(current_user)
-            has_required_role = False
-            if user.roles:
-                for role in user.roles:
-                    if role.name in roles:
-                        has_required_role = True
+            token_roles = get_jwt().get("roles")
+            if token_roles is None:
+                # Token was issued before roles were added as claim
+                user = get_current_user()
+                token_roles = user.role_names if user is not None else []
 
-            if has_required_role:
-                return f(*args, **kwargs)
-            else:
+            if required_roles.isdisjoint(token_roles):
                 return abort(403)
+            return f(*args, **kwargs)
 
         return decorated_function
 
@@ -1,10 +1,12 @@
-from flask import jsonify
+from flask import jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt
 from flask_restful import Resource, fields, marshal_with, reqparse
+from werkzeug.exceptions import TooManyRequests
 
 from server.auth import bp, api_bp
 from server.auth.utils import _create_refresh_token, _create_access_token
-from server.extensions import db
+from server.extensions import db, token_cache
+from server.passwords import PasswordHasherBusy
 from server.models.auth import User, RefreshToken
 
 login_parser = reqparse.RequestParser()
@@ -20,19 +22,29 @@ class LoginApi(Resource):
     def post(self):
         args = login_parser.parse_args()
         user = User.query.filter_by(username=args.username).first()
-        if user is None or not user.verify_password(args.password):
-            bp.logger.info("Invalid username or password")
+        try:
+            valid = user is not None and user.verify_password(args.password)
+        except PasswordHasherBusy:
+            current_app.logger.warning("Login rejected, password verification busy or timed out")
+            raise TooManyRequests("Too many logins, try again later", retry_after=1)
+        if not valid:
+            current_app.logger.info("Invalid username or password")
             return jsonify({"msg": "Bad username or password"}), 401
         refresh_token, dbo = _create_refresh_token(user)
         access_token = _create_access_token(dbo)
+        # Both tokens (and a rehashed password) are stored in one transaction
+        db.session.commit()
         return {'access_token': access_token, 'refresh_token': refresh_token}
 
     @marshal_with(refresh_fields)
     @jwt_required(refresh=True)
     def get(self):
+        # May write a new access token, a lagging replica may not know the refresh token yet
+        db.session().use_primary()
         identity = get_jwt()
         refresh_token = RefreshToken.query.filter_by(jti=identity['jti']).first()
         access_token = _create_access_token(refresh_token)
+        db.session.commit()
         return {'access_token': access_token}
 
     @jwt_required(refresh=True)
@@ -41,6 +53,7 @@ class LoginApi(Resource):
         refresh_token = RefreshToken.query.filter_by(jti=jti).first()
         refresh_token.blocked = True
         db.session.commit()
+        token_cache.invalidate()
         return {"msg": "Access token revoked"}
 
 
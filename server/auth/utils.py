@@ -1,9 +1,14 @@
-from datetime import datetime
+import time
+import uuid
+from datetime import datetime, timezone
 
-from flask_jwt_extended import create_refresh_token, decode_token, create_access_token
+from flask import current_app
+from flask_jwt_extended import create_refresh_token, create_access_token
+from sqlalchemy import and_, or_, select, update
 
 from server import AccessToken, RefreshToken, User
-from server.extensions import jwt, db
+from server.models.auth import UserSnapshot
+from server.extensions import jwt, db, token_cache, replica_router
 
 @jwt.user_identity_loader
 def user_identity_lookup(user: User):
@@ -11,42 +16,110 @@ def user_identity_lookup(user: User):
 
 @jwt.user_lookup_loader
 def user_lookup_callback(_jwt_header, jwt_data):
-    identity = jwt_data["sub"]
-    return User.query.filter_by(id=identity).one_or_none()
+    return UserSnapshot.load(jwt_data["sub"])
 
 @jwt.token_in_blocklist_loader
 def check_if_token_is_revoked(jwt_header, jwt_payload: dict):
     jti = jwt_payload["jti"]
     jwt_type = jwt_payload["type"]
-    refresh_token = None
+    if jwt_type == "access" and "refresh_jti" in jwt_payload:
+        # Stateless access token without row, it is revoked together with its refresh token
+        jti = jwt_payload["refresh_jti"]
+        jwt_type = "refresh"
+
+    refresh_token_id = token_cache.get(jti)
+    if refresh_token_id is not None:
+        return token_cache.is_blocked(refresh_token_id)
+
+    query = None
     if jwt_type == "access":
-        refresh_token = AccessToken.query.filter_by(jti=jti).first().refresh_token
+        query = select(RefreshToken.id, RefreshToken.blocked).join(AccessToken).where(AccessToken.jti == jti)
     elif jwt_type == "refresh":
-        refresh_token = RefreshToken.query.filter_by(jti=jti).first()
+        query = select(RefreshToken.id, RefreshToken.blocked).where(RefreshToken.jti == jti)
+
+    if query is None:
+        return True
+    refresh_token = db.session.execute(query, bind_arguments={'replica': True}).first()
+    from_replica = db.session().on_replica
+    if refresh_token is None and from_replica:
+        # The token may be too new for the replica, only the primary knows it is missing
+        refresh_token = db.session.execute(query, bind_arguments={'primary': True}).first()
+        from_replica = False
+    if refresh_token is None:
+        return True
+
+    # Replica rows read shortly after an invalidation may miss the change, they are not cached
+    if not from_replica or time.monotonic() - token_cache.cleared_at > replica_router.max_lag:
+        token_cache.add(jti, refresh_token.id, jwt_payload["exp"], blocked=refresh_token.blocked)
+    return bool(refresh_token.blocked)
 
-    return refresh_token is None or refresh_token.blocked
+
+def _token_claims(expires_key: str) -> dict:
+    """Generates jti and exp up front so the signed token does not have to be decoded again"""
+    expires = datetime.now(timezone.utc) + current_app.config[expires_key]
+    return {'jti': str(uuid.uuid4()), 'exp': int(expires.timestamp())}
 
 
 def _create_refresh_token(user: User) -> [str, RefreshToken]:
-    refresh_token = create_refresh_token(identity=user)
-    decoded = decode_token(refresh_token)
-    refresh_token_dbo = RefreshToken(jti=decoded['jti'],
+    """Creates a refresh token and adds its row to the session, the caller commits"""
+    claims = _token_claims('JWT_REFRESH_TOKEN_EXPIRES')
+    refresh_token = create_refresh_token(identity=user, additional_claims=claims)
+    refresh_token_dbo = RefreshToken(jti=claims['jti'],
                                      blocked=False,
-                                     user_id=user.id,
-                                     expire_date=datetime.fromtimestamp(decoded['exp']).timestamp())
+                                     user=user,
+                                     expire_date=claims['exp'],
+                                     issued_at=time.time())
 
     db.session.add(refresh_token_dbo)
-    db.session.commit()
     return refresh_token, refresh_token_dbo
 
 
 def _create_access_token(refresh_token: RefreshToken) -> str:
-    access_token = create_access_token(identity=refresh_token.user)
-    decoded = decode_token(access_token)
-    access_token_dbo = AccessToken(jti=decoded['jti'],
+    """Creates an access token and adds its row to the session (unless STATELESS_ACCESS_TOKENS), the caller commits"""
+    claims = _token_claims('JWT_ACCESS_TOKEN_EXPIRES')
+    # Roles are added as claim so role_required does not need to query the database
+    claims['roles'] = [role.name for role in refresh_token.user.roles]
+    if current_app.config.get('STATELESS_ACCESS_TOKENS'):
+        # The blocklist check follows the claim to the refresh token, no row is written
+        claims['refresh_jti'] = refresh_token.jti
+        return create_access_token(identity=refresh_token.user, additional_claims=claims)
+
+    access_token = create_access_token(identity=refresh_token.user, additional_claims=claims)
+    access_token_dbo = AccessToken(jti=claims['jti'],
                                    refresh_token=refresh_token,
-                                   expire_date=datetime.fromtimestamp(decoded['exp']).timestamp())
+                                   expire_date=claims['exp'])
 
     db.session.add(access_token_dbo)
-    db.session.commit()
     return access_token
+
+
+def _block_tokens(user_id: int = None, issued_before: float = None) -> int:
+    """Blocks the refresh tokens of a user and/or issued before a unix time with one statement, access tokens are
+    blocked with their refresh token. Commit and invalidate the token cache afterwards"""
+    conditions = [RefreshToken.blocked.isnot(True)]
+    if user_id is not None:
+        conditions.append(RefreshToken.user_id == user_id)
+    if issued_before is not None:
+        # Tokens without issued_at were issued one refresh token lifetime before they expire
+        lifetime = current_app.config['JWT_REFRESH_TOKEN_EXPIRES'].total_seconds()
+        conditions.append(or_(RefreshToken.issued_at < issued_before,
+                              and_(RefreshToken.issued_at.is_(None),
+                                   RefreshToken.expire_date < issued_before + lifetime)))
+    result = db.session.execute(update(RefreshToken).where(*conditions).values(blocked=True))
+    return result.rowcount
+
+
+def _block_user_tokens(user_id: int) -> int:
+    """Blocks all refresh tokens of a user with one statement. Commit and invalidate the token cache afterwards"""
+    return _block_tokens(user_id=user_id)
+
+
+def revoke_tokens(user_id: int = None, issued_before: float = None) -> int:
+    """Blocks the matching refresh tokens, commits and invalidates the token cache of all workers.
+
+    Returns the number of blocked tokens. Without user_id and issued_before all tokens are blocked.
+    """
+    blocked = _block_tokens(user_id=user_id, issued_before=issued_before)
+    db.session.commit()
+    token_cache.invalidate()
+    return blocked
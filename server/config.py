@@ -1,6 +1,32 @@
 import os
 from datetime import timedelta
 
+from sqlalchemy.engine import make_url
+
+
+def engine_options(uri: str) -> dict:
+    """SQLAlchemy engine options from the environment, pool settings only apply to server databases"""
+    options = {
+        # Test connections before use and replace them after some seconds (server side timeouts, fail-overs)
+        'pool_pre_ping': os.getenv("SQLALCHEMY_POOL_PRE_PING", "1") not in ("0", "false", "False"),
+        'pool_recycle': int(os.getenv("SQLALCHEMY_POOL_RECYCLE", 1800)),
+    }
+    if uri and not uri.startswith('sqlite'):
+        # Connections per worker: pool_size kept open, up to max_overflow more under load and seconds a
+        # request waits for a free connection
+        options['pool_size'] = int(os.getenv("SQLALCHEMY_POOL_SIZE", 5))
+        options['max_overflow'] = int(os.getenv("SQLALCHEMY_MAX_OVERFLOW", 10))
+        options['pool_timeout'] = float(os.getenv("SQLALCHEMY_POOL_TIMEOUT", 30))
+    if uri and uri.startswith('postgresql'):
+        if make_url(uri).get_dialect().driver == 'psycopg2':
+            # values_plus_batch also batches executemany UPDATE and DELETE statements
+            options['executemany_mode'] = os.getenv("SQLALCHEMY_EXECUTEMANY_MODE", "values_plus_batch")
+        # Statements running longer are cancelled by the server (in milliseconds, 0 disables it)
+        statement_timeout = int(os.getenv("SQLALCHEMY_STATEMENT_TIMEOUT", 30000))
+        if statement_timeout:
+            options['connect_args'] = {'options': f"-c statement_timeout={statement_timeout}"}
+    return options
+
 
 class Config:
     SECRET_KEY = os.getenv("SECRET_KEY")
@@ -10,6 +36,98 @@ class Config:
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(minutes=float(os.getenv("JWT_ACCESS_TOKEN_EXPIRES")))
     # How login an refresh is valid (in days)
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=float(os.getenv("JWT_REFRESH_TOKEN_EXPIRES")))
+    # Access tokens carry the jti of their refresh token instead of being stored, tokens of both kinds are accepted.
+    # Enable it after all workers run a version which accepts them.
+    STATELESS_ACCESS_TOKENS = os.getenv("STATELESS_ACCESS_TOKENS", "0") not in ("0", "false", "False")
+
+    # Only load the APIs, without the user management web pages
+    API_ONLY = os.getenv("API_ONLY", "0") not in ("0", "false", "False")
 
     # Database uri
-    SQLALCHEMY_DATABASE_URI = os.getenv("SQLALCHEMY_DATABASE_URI")
\ No newline at end of file
+    SQLALCHEMY_DATABASE_URI = os.getenv("SQLALCHEMY_DATABASE_URI")
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+    # Comma separated replica uris, GET requests read from them round-robin
+    SQLALCHEMY_BINDS = {f"replica_{index}": uri.strip()
+                        for index, uri in enumerate(os.getenv("SQLALCHEMY_REPLICA_URIS", "").split(","))
+                        if uri.strip()}
+    # Seconds between health checks of a replica and seconds a failed replica is skipped
+    SQLALCHEMY_REPLICA_CHECK_INTERVAL = float(os.getenv("SQLALCHEMY_REPLICA_CHECK_INTERVAL", 10))
+    SQLALCHEMY_REPLICA_RETRY_INTERVAL = float(os.getenv("SQLALCHEMY_REPLICA_RETRY_INTERVAL", 30))
+    # Seconds a replica may be behind the primary
+    SQLALCHEMY_REPLICA_MAX_LAG = float(os.getenv("SQLALCHEMY_REPLICA_MAX_LAG", 1))
+    # Connection checkouts waiting longer are logged (in milliseconds)
+    SQLALCHEMY_POOL_WAIT_WARNING = float(os.getenv("SQLALCHEMY_POOL_WAIT_WARNING", 100))
+
+    # Access log writer: queue size, records per insert and flush interval (in milliseconds)
+    ACCESS_LOG_QUEUE_SIZE = int(os.getenv("ACCESS_LOG_QUEUE_SIZE", 10000))
+    ACCESS_LOG_BATCH_SIZE = int(os.getenv("ACCESS_LOG_BATCH_SIZE", 500))
+    ACCESS_LOG_FLUSH_INTERVAL = float(os.getenv("ACCESS_LOG_FLUSH_INTERVAL", 1000))
+    # How long a request may wait for a full queue before the record is dropped (in milliseconds)
+    ACCESS_LOG_PUT_TIMEOUT = float(os.getenv("ACCESS_LOG_PUT_TIMEOUT", 0))
+    # Days per partition (Postgres) or rotated table (SQLite), days they are kept (0 keeps all) and seconds
+    # between the maintenance runs creating and dropping them
+    ACCESS_LOG_PARTITION_DAYS = int(os.getenv("ACCESS_LOG_PARTITION_DAYS", 1))
+    ACCESS_LOG_RETENTION_DAYS = int(os.getenv("ACCESS_LOG_RETENTION_DAYS", 90))
+    ACCESS_LOG_MAINTENANCE_INTERVAL = int(os.getenv("ACCESS_LOG_MAINTENANCE_INTERVAL", 3600))
+    # Requests per minute by path, method, status and user in access_log_rollup, kept for the given days
+    ACCESS_LOG_ROLLUP_ENABLED = os.getenv("ACCESS_LOG_ROLLUP_ENABLED", "1") not in ("0", "false", "False")
+    ACCESS_LOG_ROLLUP_RETENTION_DAYS = int(os.getenv("ACCESS_LOG_ROLLUP_RETENTION_DAYS", 365))
+
+    # Prometheus metrics on /metrics, set PROMETHEUS_MULTIPROC_DIR to add up the values of all gunicorn workers
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") not in ("0", "false", "False")
+
+    # Request profiling: enabled, fraction of sampled requests (admins can force it with the header X-Profile: 1),
+    # sampled profiles slower than the threshold (in milliseconds) are stored, the newest PROFILE_MAX_FILES are kept
+    PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "0") not in ("0", "false", "False")
+    PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0.01))
+    PROFILE_THRESHOLD = float(os.getenv("PROFILE_THRESHOLD", 500))
+    PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", 100))
+    # Folder of the profiles (defaults to the instance folder)
+    PROFILE_FOLDER = os.getenv("PROFILE_FOLDER")
+
+    # Users and tokens per page of the user management
+    USER_PAGE_SIZE = int(os.getenv("USER_PAGE_SIZE", 50))
+    TOKEN_PAGE_SIZE = int(os.getenv("TOKEN_PAGE_SIZE", 50))
+
+    # Token blocklist cache: enabled, number of tokens and max seconds an entry is trusted
+    TOKEN_CACHE_ENABLED = os.getenv("TOKEN_CACHE_ENABLED", "1") not in ("0", "false", "False")
+    TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+    TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", 300))
+    # File shared by all workers to signal cache invalidations (defaults to the instance folder)
+    TOKEN_CACHE_GENERATION_FILE = os.getenv("TOKEN_CACHE_GENERATION_FILE")
+    # Cache of the users loaded for tokens and web logins: enabled, number of users and max seconds an entry is kept
+    USER_CACHE_ENABLED = os.getenv("USER_CACHE_ENABLED", "1") not in ("0", "false", "False")
+    USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 1000))
+    USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 60))
+    # File shared by all workers to signal changed users (defaults to the instance folder)
+    USER_CACHE_GENERATION_FILE = os.getenv("USER_CACHE_GENERATION_FILE")
+
+    # Default and maximum number of patients per page of /api/patient/
+    PATIENT_PAGE_SIZE = int(os.getenv("PATIENT_PAGE_SIZE", 100))
+    PATIENT_PAGE_SIZE_MAX = int(os.getenv("PATIENT_PAGE_SIZE_MAX", 1000))
+    # Response cache of /api/patient/<id>: enabled, number of responses and max seconds an entry is kept
+    PATIENT_CACHE_ENABLED = os.getenv("PATIENT_CACHE_ENABLED", "1") not in ("0", "false", "False")
+    PATIENT_CACHE_SIZE = int(os.getenv("PATIENT_CACHE_SIZE", 1000))
+    PATIENT_CACHE_TTL = float(os.getenv("PATIENT_CACHE_TTL", 300))
+    # File shared by all workers to signal evictions (defaults to the instance folder)
+    PATIENT_CACHE_GENERATION_FILE = os.getenv("PATIENT_CACHE_GENERATION_FILE")
+    # Number of patients fetched per round trip by /api/patient/export
+    PATIENT_EXPORT_BATCH_SIZE = int(os.getenv("PATIENT_EXPORT_BATCH_SIZE", 500))
+
+    # Bulk measure ingestion: maximal measures per request and measures per insert transaction
+    MEASURE_BULK_MAX_ROWS = int(os.getenv("MEASURE_BULK_MAX_ROWS", 100000))
+    MEASURE_BULK_CHUNK_SIZE = int(os.getenv("MEASURE_BULK_CHUNK_SIZE", 5000))
+    # Maximal number of points (or buckets) returned by /api/appointment/<id>/series
+    MEASURE_SERIES_MAX_POINTS = int(os.getenv("MEASURE_SERIES_MAX_POINTS", 100000))
+
+    # Expired token clean-up: seconds between runs and rows deleted per transaction
+    TOKEN_CLEANUP_INTERVAL = int(os.getenv("TOKEN_CLEANUP_INTERVAL", 60))
+    TOKEN_CLEANUP_CHUNK_SIZE = int(os.getenv("TOKEN_CLEANUP_CHUNK_SIZE", 1000))
+
+    # Password hashing: werkzeug method with cost parameters (e.g. scrypt:32768:8:1 or pbkdf2:sha256:600000),
+    # outdated hashes are replaced on the next login
+    PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt")
+    # Processes per worker verifying passwords (0 verifies in the request thread)
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 1))
+    # Verifications running at the same time over all workers of a host, further logins get a 429
+    PASSWORD_HASH_CONCURRENCY = int(os.getenv("PASSWORD_HASH_CONCURRENCY", 2))
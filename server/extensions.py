@@ -1,8 +1,23 @@
 from flask_sqlalchemy import SQLAlchemy
 
-db = SQLAlchemy()
+from server.metrics import Metrics
+from server.passwords import PasswordHasher
+from server.profiler import RequestProfiler
+from server.response_cache import ResponseCache
+from server.routing import RoutingSession, ReplicaRouter
+from server.token_cache import TokenCache
+from server.user_cache import UserCache
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+replica_router = ReplicaRouter()
+token_cache = TokenCache()
+user_cache = UserCache()
+password_hasher = PasswordHasher()
+patient_cache = ResponseCache('PATIENT_CACHE')
+metrics = Metrics()
+profiler = RequestProfiler()
 migration = None
 jwt = None
 login_manager = None
 scheduler = None
-
+access_log = None
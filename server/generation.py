@@ -0,0 +1,38 @@
+import os
+import time
+
+
+class FileGeneration:
+    """Generation counter shared between processes through a small file.
+
+    A process bumps the generation after changing shared state. Every other process
+    notices the new generation on its next check and drops its local copies.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._seen = self._read()
+
+    def changed(self) -> bool:
+        current = self._read()
+        if current == self._seen:
+            return False
+        self._seen = current
+        return True
+
+    def bump(self):
+        generation = f"{os.getpid()}-{time.time_ns()}"
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(generation)
+        # replace is atomic, readers see either the old or the new generation
+        os.replace(tmp_path, self.path)
+        self._seen = generation
+
+    def _read(self) -> str:
+        try:
+            with open(self.path) as f:
+                return f.read()
+        except FileNotFoundError:
+            return ""
@@ -0,0 +1,192 @@
+import re
+from collections import Counter
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+from sqlalchemy import column, delete, func, select, table, text, DateTime
+from sqlalchemy.engine import Connection
+
+from server.models.log import AccessLog, AccessLogRollup
+
+# Partitions created in advance of the current one
+PARTITIONS_AHEAD = 2
+# Postgres partition taking rows outside of all other partitions
+DEFAULT_PARTITION = 'access_log_default'
+
+_EPOCH = datetime(1970, 1, 1)
+_TABLE_NAME = re.compile(r'access_log_\d{8}$')
+_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def period_start(timestamp: datetime, days: int) -> datetime:
+    """Start of the period of timestamp, periods of days days are counted from 1970-01-01 (UTC)"""
+    return _EPOCH + timedelta(days=(timestamp - _EPOCH).days // days * days)
+
+
+def table_name(start: datetime) -> str:
+    """Partition or rotated table holding the rows of the period starting at start"""
+    return f"{AccessLog.__tablename__}_{start:%Y%m%d}"
+
+
+def _timestamps(name: str):
+    return table(name, column('timestamp', DateTime))
+
+
+def maintain(connection: Connection, now: datetime, days: int, retention_days: int,
+             rollup_retention_days: int) -> dict:
+    """Creates the next partitions (Postgres) or rotates the table (SQLite), then drops the tables and
+    rollups older than the retention (0 keeps everything). Every step is committed on its own, so the
+    access log writers are only locked out briefly."""
+    created, dropped, deleted_rollups = [], [], 0
+    if connection.dialect.name == 'postgresql' and is_partitioned(connection):
+        created = create_partitions(connection, now, days)
+        if retention_days:
+            dropped = drop_partitions(connection, now - timedelta(days=retention_days))
+    elif connection.dialect.name == 'sqlite':
+        rotated = rotate_table(connection, now, days)
+        created = [rotated] if rotated else []
+        if retention_days:
+            dropped = drop_rotated_tables(connection, now - timedelta(days=retention_days))
+
+    if rollup_retention_days:
+        cutoff = now - timedelta(days=rollup_retention_days)
+        deleted_rollups = connection.execute(delete(AccessLogRollup).where(AccessLogRollup.minute < cutoff)).rowcount
+        connection.commit()
+    return {'created': created, 'dropped': dropped, 'deleted_rollups': deleted_rollups}
+
+
+# Postgres: access_log is partitioned by range of timestamp (see migration d4f7a2c9e1b3)
+
+def is_partitioned(connection: Connection) -> bool:
+    return bool(connection.execute(text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+                                        "WHERE partrelid = to_regclass(:name))"),
+                                   {'name': AccessLog.__tablename__}).scalar())
+
+
+def partitions(connection: Connection) -> dict:
+    """{name: exclusive upper bound} of the partitions, None for the default partition"""
+    rows = connection.execute(text("SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+                                   "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(:name)"),
+                              {'name': AccessLog.__tablename__})
+    result = {}
+    for name, bound in rows:
+        match = _UPPER_BOUND.search(bound)
+        result[name] = datetime.fromisoformat(match.group(1)) if match else None
+    return result
+
+
+def create_partitions(connection: Connection, now: datetime, days: int) -> list:
+    """Creates the partitions of the current and the next PARTITIONS_AHEAD periods which are missing"""
+    existing = partitions(connection)
+    high = max((bound for bound in existing.values() if bound is not None), default=None)
+    created = []
+    start = period_start(now, days)
+    for _ in range(PARTITIONS_AHEAD + 1):
+        end = start + timedelta(days=days)
+        lower = max(start, high) if high is not None else start
+        name = table_name(start)
+        if lower < end and name not in existing:
+            # Rows of the period which went to the default partition are moved into the new partition,
+            # attaching it fails otherwise
+            connection.execute(text(f'CREATE TABLE "{name}" (LIKE access_log INCLUDING DEFAULTS)'))
+            if DEFAULT_PARTITION in existing:
+                connection.execute(text(f'WITH moved AS (DELETE FROM "{DEFAULT_PARTITION}" '
+                                        f'WHERE "timestamp" >= :lower AND "timestamp" < :end RETURNING *) '
+                                        f'INSERT INTO "{name}" SELECT * FROM moved'),
+                                   {'lower': lower, 'end': end})
+            connection.execute(text(f'ALTER TABLE access_log ATTACH PARTITION "{name}" '
+                                    f"FOR VALUES FROM ('{lower.isoformat(' ')}') TO ('{end.isoformat(' ')}')"))
+            connection.commit()
+            created.append(name)
+        start = end
+    return created
+
+
+def drop_partitions(connection: Connection, cutoff: datetime) -> list:
+    """Drops the partitions ending before cutoff and deletes older rows of the default partition"""
+    dropped = []
+    for name, upper in sorted(partitions(connection).items()):
+        if upper is not None and upper <= cutoff:
+            connection.execute(text(f'DROP TABLE "{name}"'))
+            connection.commit()
+            dropped.append(name)
+    default = _timestamps(DEFAULT_PARTITION)
+    connection.execute(delete(default).where(default.c.timestamp < cutoff))
+    connection.commit()
+    return dropped
+
+
+# SQLite: access_log is renamed to access_log_<period start> once per period and created again
+
+def rotated_tables(connection: Connection) -> list:
+    names = connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE :pattern"),
+                               {'pattern': f'{AccessLog.__tablename__}_%'}).scalars()
+    return sorted(name for name in names if _TABLE_NAME.match(name))
+
+
+def rotate_table(connection: Connection, now: datetime, days: int) -> str:
+    """Moves the rows of earlier periods out of access_log by renaming it, returns the new name or None.
+
+    The renamed table also keeps the records of the current period written before the rotation, late records
+    of the last period stay in access_log. Ids start at 1 again in the new table.
+    """
+    # Writers wait for the rename, no record is inserted between renaming and creating the table
+    connection.exec_driver_sql('BEGIN IMMEDIATE')
+    start = period_start(now, days)
+    name = table_name(start - timedelta(days=days))
+    oldest = connection.execute(select(func.min(AccessLog.timestamp))).scalar()
+    if oldest is None or oldest >= start or name in rotated_tables(connection):
+        connection.commit()
+        return None
+
+    # Index names are unique per database, the index is created again for the renamed table
+    connection.execute(text('DROP INDEX IF EXISTS ix_access_log_timestamp'))
+    connection.execute(text(f'ALTER TABLE access_log RENAME TO "{name}"'))
+    connection.execute(text(f'CREATE INDEX "ix_{name}_timestamp" ON "{name}" ("timestamp")'))
+    AccessLog.__table__.create(connection)
+    connection.commit()
+    return name
+
+
+def drop_rotated_tables(connection: Connection, cutoff: datetime) -> list:
+    """Drops the rotated tables whose newest record is older than cutoff"""
+    dropped = []
+    for name in rotated_tables(connection):
+        timestamps = _timestamps(name)
+        newest = connection.execute(select(func.max(timestamps.c.timestamp))).scalar()
+        if newest is None or newest < cutoff:
+            connection.execute(text(f'DROP TABLE "{name}"'))
+            dropped.append(name)
+        connection.commit()
+    return dropped
+
+
+# Rollups: requests per minute by path, method, status and user
+
+def rollup_rows(records: list) -> list:
+    """Counts of access log records by minute and key, ordered by key.
+
+    The path is counted without host and query string. Concurrent writers update the rows in the same
+    order, so their upserts do not deadlock.
+    """
+    length = AccessLogRollup.path.type.length
+    counts = Counter((record['timestamp'].replace(second=0, microsecond=0), urlsplit(record['path']).path[:length],
+                      record['method'], record['response_code'], record['username'])
+                     for record in records)
+    return [{'minute': minute, 'path': path, 'method': method, 'response_code': response_code,
+             'username': username, 'requests': requests}
+            for (minute, path, method, response_code, username), requests in sorted(counts.items())]
+
+
+def rollup_upsert(dialect: str):
+    """INSERT adding the counts of existing rollup rows, None for databases without ON CONFLICT"""
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    statement = insert(AccessLogRollup)
+    return statement.on_conflict_do_update(
+        index_elements=list(AccessLogRollup.__table__.primary_key.columns),
+        set_={'requests': AccessLogRollup.requests + statement.excluded['requests']})
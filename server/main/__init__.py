@@ -5,4 +5,5 @@ bp = Blueprint('patient', __name__)
 api_bp = Api(bp)
 
 from server.main import patient_routes
+from server.main import measure_routes
 
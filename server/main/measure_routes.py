@@ -0,0 +1,282 @@
+import json
+import math
+import threading
+import time
+from datetime import datetime
+
+from flask import request, current_app, Response
+from flask_jwt_extended import jwt_required
+from flask_restful import Resource, abort, reqparse
+from sqlalchemy import insert, select, func, case, cast, Integer
+from sqlalchemy.exc import SQLAlchemyError
+
+from server.auth.decorator import role_required
+from server.extensions import db, patient_cache
+from server.main import api_bp
+from server.models.main import Measure, Appointment, Category
+from server.utils import parse_timestamp
+
+# Maximal number of ids per IN clause when checking appointments
+_LOOKUP_CHUNK_SIZE = 500
+# Ids are 32 bit integer columns
+_MAX_ID = 2 ** 31 - 1
+# Narrowest bucket of a measure series in seconds, the bucket indexes of all timestamps fit into 64 bit
+_MIN_BUCKET = 0.001
+
+
+def _finite_float(value) -> float:
+    """float of value, raises ValueError for NaN, infinity and numbers beyond the float range"""
+    try:
+        number = float(value)
+    except OverflowError:
+        raise ValueError("number out of range")
+    if not math.isfinite(number):
+        raise ValueError("number is not finite")
+    return number
+
+
+def _timestamp_argument(value: str) -> float:
+    """Unix timestamp or ISO date"""
+    try:
+        return _finite_float(value)
+    except ValueError:
+        return parse_timestamp(value)
+
+
+series_parser = reqparse.RequestParser()
+series_parser.add_argument('category', type=str, location='args', required=True, help="Category id or name")
+series_parser.add_argument('start', type=_timestamp_argument, location='args', help="Unix timestamp or ISO date")
+series_parser.add_argument('end', type=_timestamp_argument, location='args', help="Unix timestamp or ISO date")
+series_parser.add_argument('bucket', type=_finite_float, location='args', help="Bucket width in seconds")
+series_parser.add_argument('format', type=str, location='args', choices=('columns', 'rows'), default='columns')
+
+
+class CategoryLookup:
+    """Cache of category ids and names.
+
+    Categories change rarely, the table is reloaded on a miss but at most once per reload_interval seconds.
+    """
+
+    def __init__(self, reload_interval: float = 1.0):
+        self.reload_interval = reload_interval
+        self._ids = set()
+        self._names = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def resolve(self, value):
+        category_id = self._find(value)
+        if category_id is None and time.monotonic() - self._loaded_at > self.reload_interval:
+            self.reload()
+            category_id = self._find(value)
+        return category_id
+
+    def reload(self):
+        categories = db.session.execute(select(Category.id, Category.name)).all()
+        with self._lock:
+            self._ids = {category.id for category in categories}
+            self._names = {category.name: category.id for category in categories}
+            self._loaded_at = time.monotonic()
+
+    def _find(self, value):
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value if value in self._ids else None
+        if isinstance(value, str):
+            return self._names.get(value)
+        return None
+
+
+category_lookup = CategoryLookup()
+
+
+def _read_rows() -> list:
+    """Reads a JSON array or NDJSON (application/x-ndjson) body"""
+    try:
+        if request.mimetype == 'application/x-ndjson':
+            return [json.loads(line) for line in request.get_data().splitlines() if line.strip()]
+        rows = json.loads(request.get_data())
+    except ValueError as error:
+        abort(400, message=f"Invalid body: {error}")
+    if not isinstance(rows, list):
+        abort(400, message="Body has to be a JSON array of measures")
+    return rows
+
+
+def _parse_row(row) -> dict:
+    """Converts one measure to an insertable row, raises ValueError on invalid data"""
+    if not isinstance(row, dict):
+        raise ValueError("measure has to be an object")
+
+    appointment_id = row.get('appointment_id')
+    if not isinstance(appointment_id, int) or isinstance(appointment_id, bool):
+        raise ValueError("appointment_id has to be an integer")
+    if not -_MAX_ID - 1 <= appointment_id <= _MAX_ID:
+        raise ValueError("appointment_id out of range")
+
+    category = row.get('category_id', row.get('category'))
+    if category is not None and (not isinstance(category, (int, str)) or isinstance(category, bool)):
+        raise ValueError("category has to be an id or a name")
+    category_id = category_lookup.resolve(category) if category is not None else None
+    if category_id is None:
+        raise ValueError(f"unknown category {category!r}")
+
+    value = row.get('value')
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        raise ValueError("value has to be a number")
+    try:
+        value = _finite_float(value)
+    except ValueError:
+        raise ValueError("value has to be a finite number")
+
+    timestamp = row.get('timestamp')
+    if isinstance(timestamp, str):
+        timestamp = parse_timestamp(timestamp)
+    elif not isinstance(timestamp, (int, float)) or isinstance(timestamp, bool):
+        raise ValueError("timestamp has to be an ISO date or a unix timestamp")
+    # The timestamp has to be formattable as date (format_timestamp) for the patient endpoints
+    try:
+        datetime.fromtimestamp(timestamp)
+    except (OverflowError, OSError, ValueError):
+        raise ValueError("timestamp out of range")
+
+    marker = row.get('marker')
+    if marker is not None and (not isinstance(marker, str) or len(marker) > Measure.marker.type.length):
+        raise ValueError(f"marker has to be a string of at most {Measure.marker.type.length} characters")
+
+    return {'appointment_id': appointment_id,
+            'category_id': category_id,
+            'value': value,
+            '_timestamp': float(timestamp),
+            'marker': marker}
+
+
+def _existing_appointments(appointment_ids: set) -> dict:
+    """Maps the ids of existing appointments to their patient ids"""
+    ids = list(appointment_ids)
+    existing = {}
+    for start in range(0, len(ids), _LOOKUP_CHUNK_SIZE):
+        chunk = ids[start:start + _LOOKUP_CHUNK_SIZE]
+        existing.update(db.session.execute(select(Appointment.id, Appointment.patient_id)
+                                           .where(Appointment.id.in_(chunk))).all())
+    return existing
+
+
+class MeasureBulkApi(Resource):
+    @jwt_required()
+    @role_required(["user"])
+    def post(self):
+        rows = _read_rows()
+        max_rows = current_app.config.get('MEASURE_BULK_MAX_ROWS', 100000)
+        if len(rows) > max_rows:
+            abort(413, message=f"At most {max_rows} measures per request")
+
+        # Validate everything first, only valid rows are inserted
+        errors = []
+        valid = []
+        for index, row in enumerate(rows):
+            try:
+                valid.append((index, _parse_row(row)))
+            except ValueError as error:
+                errors.append({'index': index, 'error': str(error)})
+
+        existing = _existing_appointments({row['appointment_id'] for _, row in valid})
+        insertable = []
+        for index, row in valid:
+            if row['appointment_id'] in existing:
+                insertable.append((index, row))
+            else:
+                errors.append({'index': index, 'error': f"unknown appointment {row['appointment_id']}"})
+
+        # Every chunk is one executemany statement in its own transaction
+        chunk_size = current_app.config.get('MEASURE_BULK_CHUNK_SIZE', 5000)
+        inserted = 0
+        for start in range(0, len(insertable), chunk_size):
+            chunk = insertable[start:start + chunk_size]
+            try:
+                db.session.execute(insert(Measure), [row for _, row in chunk])
+                # Core inserts do not trigger the mapper events of Measure
+                patient_cache.invalidate_after_commit(db.session(), {existing[row['appointment_id']]
+                                                                     for _, row in chunk})
+                db.session.commit()
+                inserted += len(chunk)
+            except SQLAlchemyError as error:
+                db.session.rollback()
+                current_app.logger.warning("Could not insert %d measures: %s", len(chunk), error)
+                errors.extend({'index': index, 'error': "database error"} for index, _ in chunk)
+
+        errors.sort(key=lambda error: error['index'])
+        return {'received': len(rows), 'inserted': inserted, 'failed': len(errors), 'errors': errors}
+
+
+def _bucket_index(origin: float, bucket: float):
+    offset = (Measure._timestamp - origin) / bucket
+    # SQLite has no floor without the math functions, CAST truncates towards zero
+    if db.engine.dialect.name == 'sqlite':
+        truncated = cast(offset, Integer)
+        return case((offset < truncated, truncated - 1), else_=truncated)
+    return func.floor(offset)
+
+
+class MeasureSeriesApi(Resource):
+    """Measures of one category of an appointment as columns, optionally downsampled to buckets"""
+
+    @jwt_required()
+    @role_required(["user"])
+    def get(self, appointment_id):
+        args = series_parser.parse_args()
+        category = args['category']
+        category_id = category_lookup.resolve(int(category) if category.isdigit() else category)
+        if category_id is None:
+            abort(400, message=f"Unknown category {category!r}")
+        bucket = args['bucket']
+        max_points = current_app.config.get('MEASURE_SERIES_MAX_POINTS', 100000)
+        if bucket is not None and bucket < _MIN_BUCKET:
+            abort(400, message=f"bucket has to be at least {_MIN_BUCKET} seconds")
+        if (bucket is not None and args['start'] is not None and args['end'] is not None
+                and (args['end'] - args['start']) / bucket > max_points):
+            abort(400, message=f"More than {max_points} buckets, select a shorter range or a wider bucket")
+
+        conditions = [Measure.appointment_id == appointment_id, Measure.category_id == category_id]
+        if args['start'] is not None:
+            conditions.append(Measure._timestamp >= args['start'])
+        if args['end'] is not None:
+            conditions.append(Measure._timestamp < args['end'])
+
+        if bucket is None:
+            columns, keys = ('timestamps', 'values'), ('timestamp', 'value')
+            query = select(Measure._timestamp, Measure.value).where(*conditions).order_by(Measure._timestamp)
+        else:
+            # Buckets start at start (or the epoch) and are aggregated by the database
+            origin = args['start'] or 0.0
+            columns = ('timestamps', 'min', 'max', 'avg', 'count')
+            keys = ('timestamp', 'min', 'max', 'avg', 'count')
+            points = select(_bucket_index(origin, bucket).label('bucket'), Measure.value).where(*conditions).subquery()
+            query = (select(points.c.bucket * bucket + origin,
+                            func.min(points.c.value),
+                            func.max(points.c.value),
+                            func.avg(points.c.value),
+                            func.count())
+                     .group_by(points.c.bucket)
+                     .order_by(points.c.bucket))
+
+        rows = db.session.execute(query.limit(max_points + 1)).all()
+        if len(rows) > max_points:
+            abort(400, message=f"More than {max_points} points, select a shorter range or a wider bucket")
+        if not rows and db.session.get(Appointment, appointment_id) is None:
+            abort(404, message=f"Appointment {appointment_id} not found")
+
+        series = {'appointment_id': appointment_id,
+                  'category_id': category_id,
+                  'start': args['start'],
+                  'end': args['end'],
+                  'bucket': bucket}
+        if args['format'] == 'rows':
+            series['points'] = [dict(zip(keys, row)) for row in rows]
+        else:
+            values = list(zip(*rows)) or [()] * len(columns)
+            series.update({column: list(column_values) for column, column_values in zip(columns, values)})
+        return Response(json.dumps(series), mimetype='application/json')
+
+
+api_bp.add_resource(MeasureBulkApi, '/measure/bulk')
+api_bp.add_resource(MeasureSeriesApi, '/appointment/<int:appointment_id>/series')
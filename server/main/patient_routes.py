@@ -1,21 +1,84 @@
-from flask import jsonify
+import json
+import time
+from functools import lru_cache
+
+from flask import jsonify, current_app, request, Response, stream_with_context
 from flask_jwt_extended import jwt_required
-from flask_restful import Resource, fields, marshal_with, reqparse
+from flask_restful import Resource, fields, reqparse, abort
+from sqlalchemy.orm import lazyload, selectinload
 
 from server.auth.decorator import role_required
-from server.extensions import db
+from server.extensions import db, patient_cache, replica_router
 from server.main import api_bp
-from server.models.main import Patient
+from server.models.main import Patient, Appointment
+from server.serializer import compile_fields
+
+# Depth of the nested tree: no appointments, appointments without measures or everything
+EXPAND_LEVELS = ('none', 'appointments', 'measures')
+
+projection_parser = reqparse.RequestParser()
+projection_parser.add_argument('fields', type=str, location='args')
+projection_parser.add_argument('expand', type=str, location='args', choices=EXPAND_LEVELS)
+
+patients_parser = projection_parser.copy()
+patients_parser.add_argument('limit', type=int, location='args')
+patients_parser.add_argument('cursor', type=int, location='args')
+
+export_parser = projection_parser.copy()
+export_parser.add_argument('format', type=str, location='args', choices=('json', 'ndjson'), default='json')
+
+
+def _parse_projection(args) -> [tuple, str]:
+    """Returns the requested patient fields and expand level, all fields are returned by default"""
+    available = Patient.get_fields().keys()
+    selected = tuple(available)
+    if args['fields']:
+        selected = tuple(field.strip() for field in args['fields'].split(',') if field.strip())
+        unknown = set(selected) - set(available)
+        if unknown:
+            abort(400, message=f"Unknown fields: {', '.join(sorted(unknown))}")
+
+    expand = args['expand'] or 'measures'
+    if 'appointments' not in selected:
+        expand = 'none'
+    elif expand == 'none':
+        selected = tuple(field for field in selected if field != 'appointments')
+    # e.g. fields=, or fields=appointments&expand=none
+    if not selected:
+        abort(400, message="No fields selected")
+    return selected, expand
+
+
+def _projection_fields(selected: tuple, expand: str) -> dict:
+    patient_fields = Patient.get_fields()
+    if expand == 'appointments':
+        appointment_fields = Appointment.get_fields()
+        del appointment_fields['measures']
+        patient_fields['appointments'] = fields.List(fields.Nested(appointment_fields))
+    return {key: patient_fields[key] for key in selected}
+
+
+@lru_cache(maxsize=64)
+def _projection_serializer(selected: tuple, expand: str):
+    return compile_fields(_projection_fields(selected, expand), 'serialize_patient')
+
+
+def _projection_options(expand: str) -> list:
+    # Skip loading the nested rows which are not part of the response
+    if expand == 'none':
+        return [lazyload(Patient.appointments)]
+    if expand == 'appointments':
+        return [selectinload(Patient.appointments).lazyload(Appointment.measures)]
+    return []
 
-patient_list_fields = {'patients': fields.List(fields.Nested(Patient.get_fields()))}
 
-patients_parser = reqparse.RequestParser()
+# Serializer of the full patient, compiled once at import
+serialize_patient = _projection_serializer(tuple(Patient.get_fields().keys()), 'measures')
 
 
 class PatientApi(Resource):
     @jwt_required()
     @role_required(["user"])
-    @marshal_with(Patient.get_fields())
     def put(self, user_id):
         parser = Patient.get_parser()
         args = parser.parse_args()
@@ -25,14 +88,34 @@ class PatientApi(Resource):
         patient.birthday = args['birthday'] or patient.birthday
         patient.comments = args['comments'] or patient.comments
         db.session.commit()
-        return patient
+        return serialize_patient(patient)
 
     @jwt_required()
     @role_required(["user"])
-    @marshal_with(Patient.get_fields())
     def get(self, user_id):
-        patient = Patient.query.get_or_404(user_id)
-        return patient
+        selected, expand = _parse_projection(projection_parser.parse_args())
+        try:
+            patient_id = int(user_id)
+        except ValueError:
+            abort(404)
+        key = (patient_id, selected, expand)
+        cached = patient_cache.get(key)
+        if cached is not None:
+            etag, body = cached
+        else:
+            patient = Patient.query.options(*_projection_options(expand)).get_or_404(patient_id)
+            body = json.dumps(_projection_serializer(selected, expand)(patient)).encode()
+            # A replica may still return a patient evicted moments ago, such responses are not cached
+            if db.session().on_replica and time.monotonic() - patient_cache.invalidated_at < replica_router.max_lag:
+                etag = patient_cache.etag(body)
+            else:
+                etag = patient_cache.put(key, body)
+
+        response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        # Clients may keep the response but have to revalidate it with If-None-Match
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
 
     @jwt_required()
     @role_required(["user"])
@@ -46,21 +129,72 @@ class PatientApi(Resource):
 class PatientListApi(Resource):
     @jwt_required()
     @role_required(["user"])
-    @marshal_with(patient_list_fields)
     def get(self):
-        patients = Patient.query.all()
-        return {'patients': patients}
+        args = patients_parser.parse_args()
+        selected, expand = _parse_projection(args)
+        max_limit = current_app.config.get('PATIENT_PAGE_SIZE_MAX', 1000)
+        limit = args['limit']
+        if limit is None:
+            limit = current_app.config.get('PATIENT_PAGE_SIZE', 100)
+        if not 0 < limit <= max_limit:
+            abort(400, message=f"limit has to be between 1 and {max_limit}")
+
+        # Keyset pagination, the cursor is the id of the last patient of the previous page
+        query = Patient.query.options(*_projection_options(expand)).order_by(Patient.id)
+        if args['cursor'] is not None:
+            query = query.filter(Patient.id > args['cursor'])
+        patients = query.limit(limit + 1).all()
+
+        next_cursor = None
+        if len(patients) > limit:
+            patients = patients[:limit]
+            next_cursor = patients[-1].id
+
+        serialize = _projection_serializer(selected, expand)
+        return {'patients': [serialize(patient) for patient in patients],
+                'next_cursor': next_cursor}
 
     @jwt_required()
     @role_required(["user"])
-    @marshal_with(Patient.get_fields())
     def post(self):
         args = Patient.get_parser().parse_args()
         patient = Patient(**args)
         db.session.add(patient)
         db.session.commit()
-        return patient
+        return serialize_patient(patient)
+
+
+class PatientExportApi(Resource):
+    @jwt_required()
+    @role_required(["user"])
+    def get(self):
+        args = export_parser.parse_args()
+        selected, expand = _parse_projection(args)
+        serialize = _projection_serializer(selected, expand)
+        batch_size = current_app.config.get('PATIENT_EXPORT_BATCH_SIZE', 500)
+        # yield_per streams the patients from a server-side cursor, only one batch is held in memory
+        query = (db.select(Patient)
+                 .options(*_projection_options(expand))
+                 .order_by(Patient.id)
+                 .execution_options(yield_per=batch_size))
+
+        def generate_ndjson():
+            for patients in db.session.execute(query).scalars().partitions():
+                yield ''.join(json.dumps(serialize(patient)) + '\n' for patient in patients)
+
+        def generate_json():
+            separator = ''
+            yield '['
+            for patients in db.session.execute(query).scalars().partitions():
+                yield separator + ','.join(json.dumps(serialize(patient)) for patient in patients)
+                separator = ','
+            yield ']'
+
+        if args['format'] == 'ndjson':
+            return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+        return Response(stream_with_context(generate_json()), mimetype='application/json')
 
 
 api_bp.add_resource(PatientApi, '/patient/<user_id>')
 api_bp.add_resource(PatientListApi, '/patient/')
+api_bp.add_resource(PatientExportApi, '/patient/export')
@@ -0,0 +1,239 @@
+import os
+import threading
+import time
+
+from flask import Flask, Response, current_app, g, has_request_context, request
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, \
+    generate_latest, multiprocess
+from sqlalchemy import event
+
+# Endpoint label of requests which did not match a route
+UNMATCHED = 'unmatched'
+
+REQUESTS = Counter('http_requests_total', 'Requests by endpoint (blueprint.resource), method and status',
+                   ['endpoint', 'method', 'status'])
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Request latency by endpoint and method',
+                            ['endpoint', 'method'])
+REQUEST_QUERIES = Histogram('http_request_db_queries', 'SQL statements executed per request', ['endpoint'],
+                            buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144))
+REQUEST_DB_SECONDS = Histogram('http_request_db_seconds', 'Time spent in SQL statements per request',
+                               ['endpoint'])
+CACHE_LOOKUPS = Counter('cache_lookups_total', 'Lookups of the token blocklist, user and patient response caches',
+                        ['cache', 'result'])
+PASSWORD_VERIFICATIONS = Counter('password_verifications_total', 'Finished password verifications')
+PASSWORD_SECONDS = Counter('password_verification_seconds_total',
+                           'Time spent verifying passwords, divided by password_verifications_total the mean latency')
+PASSWORD_REJECTED = Counter('password_verifications_rejected_total',
+                            'Logins rejected because all slots were in use or the verification timed out', ['reason'])
+PASSWORD_POOL_RESTARTS = Counter('password_pool_restarts_total', 'Verification pools replaced after a process died')
+PASSWORD_REHASHES = Counter('password_rehashes_total', 'Outdated password hashes replaced on login')
+ACCESS_LOG_RECORDS = Counter('access_log_records_total',
+                             'Access log records written, dropped on a full queue or lost by a failed insert',
+                             ['result'])
+TASK_RUNS = Counter('task_runs_total', 'Runs of the scheduled jobs, skipped if another process held the job lock',
+                    ['task', 'result'])
+TOKEN_CLEANUP_DELETED = Counter('token_cleanup_deleted_total', 'Expired tokens deleted by the clean-up job', ['token'])
+ACCESS_LOG_TABLES = Counter('access_log_tables_total',
+                            'Access log partitions or rotated tables created and dropped by the maintenance job',
+                            ['action'])
+ACCESS_LOG_ROLLUPS_DELETED = Counter('access_log_rollups_deleted_total', 'Rollup rows deleted after their retention')
+DB_POOL_CHECKOUTS = Counter('db_pool_checkouts_total', 'Connections checked out of the pool of an engine', ['bind'])
+DB_POOL_TIMEOUTS = Counter('db_pool_timeouts_total', 'Checkouts which found no connection in time', ['bind'])
+DB_POOL_WAIT_SECONDS = Counter('db_pool_wait_seconds_total', 'Time spent waiting for a connection', ['bind'])
+# Gauges are summed (in flight) or maximized over the live workers
+PASSWORD_IN_FLIGHT = Gauge('password_verifications_in_flight', 'Password verifications running',
+                           multiprocess_mode='livesum')
+PASSWORD_IN_FLIGHT_MAX = Gauge('password_verifications_in_flight_max',
+                               'Most password verifications running at once in a worker', multiprocess_mode='livemax')
+ACCESS_LOG_QUEUE = Gauge('access_log_queue_depth', 'Access log records waiting to be written',
+                         multiprocess_mode='livesum')
+ACCESS_LOG_QUEUE_MAX = Gauge('access_log_queue_depth_max', 'Deepest access log queue of a worker',
+                             multiprocess_mode='livemax')
+DB_POOL_CHECKED_OUT = Gauge('db_pool_checked_out', 'Connections in use', ['bind'], multiprocess_mode='livesum')
+DB_POOL_OVERFLOW = Gauge('db_pool_overflow', 'Connections beyond the pool size', ['bind'],
+                         multiprocess_mode='livesum')
+DB_POOL_CHECKED_OUT_MAX = Gauge('db_pool_checked_out_max', 'Most connections of a worker in use at once', ['bind'],
+                                multiprocess_mode='livemax')
+DB_POOL_OVERFLOW_MAX = Gauge('db_pool_overflow_max', 'Most overflow connections of a worker at once', ['bind'],
+                             multiprocess_mode='livemax')
+DB_POOL_WAIT_MAX = Gauge('db_pool_wait_max_seconds', 'Longest wait of a worker for a connection', ['bind'],
+                         multiprocess_mode='livemax')
+TASK_LAST_RUN = Gauge('task_last_run_timestamp_seconds', 'Unix time of the last run of a scheduled job', ['task'],
+                      multiprocess_mode='max')
+TASK_LAST_DURATION = Gauge('task_last_duration_seconds', 'Duration of the last run of a scheduled job', ['task'],
+                           multiprocess_mode='mostrecent')
+
+# app.extensions keys of the caches with hits and misses counters
+CACHES = ('token_cache', 'user_cache', 'patient_cache')
+CACHE_RESULTS = (('hits', 'hit'), ('misses', 'miss'))
+# Plain counters of the extensions (app.extensions key, attribute) and the Prometheus counter they are added to
+EXTENSION_COUNTERS = (('password_hasher', 'verifications', PASSWORD_VERIFICATIONS),
+                      ('password_hasher', 'total_seconds', PASSWORD_SECONDS),
+                      ('password_hasher', 'rejected', PASSWORD_REJECTED.labels('busy')),
+                      ('password_hasher', 'timeouts', PASSWORD_REJECTED.labels('timeout')),
+                      ('password_hasher', 'pool_restarts', PASSWORD_POOL_RESTARTS),
+                      ('password_hasher', 'rehashed', PASSWORD_REHASHES),
+                      ('access_log', 'written', ACCESS_LOG_RECORDS.labels('written')),
+                      ('access_log', 'dropped', ACCESS_LOG_RECORDS.labels('dropped')),
+                      ('access_log', 'failed', ACCESS_LOG_RECORDS.labels('failed')))
+# Bind label of the primary database, replicas are labelled with their SQLALCHEMY_BINDS key
+PRIMARY_BIND = 'primary'
+# PoolStats.report() keys added to counters and set on gauges
+POOL_COUNTERS = (('checkouts', DB_POOL_CHECKOUTS), ('timeouts', DB_POOL_TIMEOUTS), ('wait_total', DB_POOL_WAIT_SECONDS))
+POOL_GAUGES = (('checked_out', DB_POOL_CHECKED_OUT), ('overflow', DB_POOL_OVERFLOW),
+               ('checked_out_max', DB_POOL_CHECKED_OUT_MAX), ('overflow_max', DB_POOL_OVERFLOW_MAX),
+               ('wait_max', DB_POOL_WAIT_MAX))
+# Statistics dicts of server.tasks: (variable, task name, {key: counter})
+TASK_STATS = (('cleanup_stats', 'clear_expired_tokens',
+               {'runs': TASK_RUNS.labels('clear_expired_tokens', 'run'),
+                'skipped': TASK_RUNS.labels('clear_expired_tokens', 'skipped'),
+                'deleted_access_tokens': TOKEN_CLEANUP_DELETED.labels('access'),
+                'deleted_refresh_tokens': TOKEN_CLEANUP_DELETED.labels('refresh')}),
+              ('access_log_stats', 'maintain_access_log',
+               {'runs': TASK_RUNS.labels('maintain_access_log', 'run'),
+                'skipped': TASK_RUNS.labels('maintain_access_log', 'skipped'),
+                'created_tables': ACCESS_LOG_TABLES.labels('created'),
+                'dropped_tables': ACCESS_LOG_TABLES.labels('dropped'),
+                'deleted_rollups': ACCESS_LOG_ROLLUPS_DELETED}))
+# Current values of the extensions set on gauges
+EXTENSION_GAUGES = (('password_hasher', 'in_flight', PASSWORD_IN_FLIGHT),
+                    ('password_hasher', 'max_in_flight', PASSWORD_IN_FLIGHT_MAX),
+                    ('access_log', 'depth', ACCESS_LOG_QUEUE),
+                    ('access_log', 'max_depth', ACCESS_LOG_QUEUE_MAX))
+
+
+class Metrics:
+    """Prometheus metrics of requests, their SQL statements and the caches, exposed on /metrics.
+
+    With PROMETHEUS_MULTIPROC_DIR set (before the first import of prometheus_client) every gunicorn worker
+    writes its values to mmap files in that folder and /metrics adds up the files of all workers.
+    """
+
+    def __init__(self, app: Flask = None):
+        self.enabled = True
+        # Values of the plain counters already added to the Prometheus counters by this process
+        self._seen = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask):
+        app.config.setdefault('METRICS_ENABLED', True)
+        self.enabled = bool(app.config['METRICS_ENABLED'])
+        if not self.enabled:
+            return
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        db = app.extensions['sqlalchemy']
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+                event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        # Not part of a blueprint: no authentication and no access log
+        app.add_url_rule('/metrics', 'metrics', self.view)
+        app.extensions['metrics'] = self
+
+    @staticmethod
+    def registry():
+        if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+            return REGISTRY
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+
+    def view(self):
+        self._sync()
+        return Response(generate_latest(self.registry()), content_type=CONTENT_TYPE_LATEST)
+
+    @staticmethod
+    def _before_request():
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_db_seconds = 0.0
+
+    def _after_request(self, response):
+        self._record(response.status_code)
+        return response
+
+    def _teardown_request(self, exc):
+        # Unhandled exceptions skip after_request
+        if exc is not None:
+            self._record(500)
+
+    def _record(self, status: int):
+        start = g.pop('metrics_start', None)
+        if start is None or request.endpoint == 'metrics':
+            return
+        endpoint = request.endpoint or UNMATCHED
+        REQUESTS.labels(endpoint, request.method, status).inc()
+        REQUEST_SECONDS.labels(endpoint, request.method).observe(time.perf_counter() - start)
+        REQUEST_QUERIES.labels(endpoint).observe(g.metrics_queries)
+        REQUEST_DB_SECONDS.labels(endpoint).observe(g.metrics_db_seconds)
+        self._sync()
+
+    def _sync(self):
+        # The extensions count in plain numbers, the increase since the last sync is added after every request
+        # and before every scrape
+        with self._lock:
+            extensions = current_app.extensions
+            for name in CACHES:
+                cache = extensions.get(name)
+                if cache is None:
+                    continue
+                for attribute, result in CACHE_RESULTS:
+                    self._add((name, attribute), getattr(cache, attribute), CACHE_LOOKUPS.labels(name, result))
+            for name, attribute, counter in EXTENSION_COUNTERS:
+                if name in extensions:
+                    self._add((name, attribute), getattr(extensions[name], attribute), counter)
+            for name, attribute, gauge in EXTENSION_GAUGES:
+                if name in extensions:
+                    gauge.set(getattr(extensions[name], attribute))
+            self._sync_pools(extensions['sqlalchemy'])
+            self._sync_tasks()
+
+    def _sync_pools(self, db):
+        for key, engine in db.engines.items():
+            stats = getattr(engine.pool, 'stats', None)
+            if stats is None:
+                continue
+            bind = key or PRIMARY_BIND
+            report = stats.report()
+            for name, counter in POOL_COUNTERS:
+                self._add(('pool', bind, name), report[name], counter.labels(bind))
+            for name, gauge in POOL_GAUGES:
+                gauge.labels(bind).set(report[name])
+
+    def _sync_tasks(self):
+        from server import tasks  # server.tasks imports the models, which import the extensions
+        for variable, task, counters in TASK_STATS:
+            stats = getattr(tasks, variable)
+            for key, counter in counters.items():
+                self._add((variable, key), stats[key], counter)
+            # Only the worker which ran the job sets the gauges, the others would report their older runs
+            if stats['last_run'] is not None and stats['last_run'] != self._seen.get((variable, 'last_run')):
+                TASK_LAST_RUN.labels(task).set(stats['last_run'])
+                TASK_LAST_DURATION.labels(task).set(stats['last_duration'])
+                self._seen[(variable, 'last_run')] = stats['last_run']
+
+    def _add(self, key, value, counter):
+        seen = self._seen.get(key, 0)
+        if value > seen:
+            counter.inc(value - seen)
+        self._seen[key] = value
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+    @staticmethod
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('metrics_start')
+        if not starts:
+            return
+        duration = time.perf_counter() - starts.pop()
+        if has_request_context() and 'metrics_queries' in g:
+            g.metrics_queries += 1
+            g.metrics_db_seconds += duration
@@ -1,7 +1,10 @@
+import time
+from typing import Optional
+
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.orm import selectinload
 
-from server.extensions import db
+from server.extensions import db, password_hasher, replica_router, user_cache
 
 user_role = db.Table('user_role',
                      db.Column('role_id', db.Integer, db.ForeignKey('role.id')),
@@ -10,19 +13,25 @@ user_role = db.Table('user_role',
 
 class AccessToken(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    jti = db.Column(db.String(36), nullable=False, index=True)
-    expire_date = db.Column(db.Double, nullable=False)
+    jti = db.Column(db.String(36), nullable=False, index=True, unique=True)
+    expire_date = db.Column(db.Double, nullable=False, index=True)
     refresh_token_id = db.Column(db.Integer,
                                  db.ForeignKey('refresh_token.id'),
-                                 nullable=False)
+                                 nullable=False,
+                                 index=True)
 
 
 class RefreshToken(db.Model):
+    # Tokens of a user in expiry order, also serves lookups by user_id
+    __table_args__ = (db.Index('ix_refresh_token_user_expiry', 'user_id', 'expire_date'),)
+
     id = db.Column(db.Integer, primary_key=True)
-    jti = db.Column(db.String(36), nullable=False, index=True)
+    jti = db.Column(db.String(36), nullable=False, index=True, unique=True)
     blocked = db.Column(db.Boolean)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    expire_date = db.Column(db.Double, nullable=False)
+    expire_date = db.Column(db.Double, nullable=False, index=True)
+    # Unix time of the login, None for tokens created before the column existed
+    issued_at = db.Column(db.Double)
     user = db.relationship('User', backref='refresh_tokens')
     access_tokens = db.relationship('AccessToken', backref='refresh_token', cascade="all, delete-orphan")
 
@@ -47,13 +56,64 @@ class User(UserMixin, db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        """Raises PasswordHasherBusy if too many verifications are running, rehashes outdated hashes"""
+        if not password_hasher.verify(self.password_hash, password):
+            return False
+        if password_hasher.needs_rehash(self.password_hash):
+            # stored with the next commit
+            self.password = password
+            password_hasher.rehashed += 1
+        return True
 
     def has_role(self, role_name: str) -> bool:
         for role in self.roles:
             if role.name == role_name:
                 return True
         return False
+
+    @property
+    def role_names(self) -> tuple:
+        return tuple(role.name for role in self.roles)
+
+    def snapshot(self) -> 'UserSnapshot':
+        return UserSnapshot(self.id, self.username, self.role_names)
+
+
+class UserSnapshot(UserMixin):
+    """Detached, read-only copy of a user with its role names, returned by the JWT and flask-login user loaders.
+
+    The user cache shares one snapshot between requests and threads, its attributes cannot be set after creation.
+    """
+
+    def __init__(self, id: int, username: str, role_names: tuple):
+        object.__setattr__(self, 'id', id)
+        object.__setattr__(self, 'username', username)
+        object.__setattr__(self, 'role_names', tuple(role_names))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def has_role(self, role_name: str) -> bool:
+        return role_name in self.role_names
+
+    @classmethod
+    def load(cls, user_id) -> Optional['UserSnapshot']:
+        """Snapshot of a user from the user cache, a miss loads the user with its roles"""
+        user_id = int(user_id)
+        snapshot = user_cache.get(user_id)
+        if snapshot is not None:
+            return snapshot
+        user = db.session.get(User, user_id, options=[selectinload(User.roles)])
+        if user is None:
+            return None
+        snapshot = user.snapshot()
+        # Replica rows read shortly after an invalidation may miss the change, they are not cached
+        if not db.session().on_replica or time.monotonic() - user_cache.invalidated_at > replica_router.max_lag:
+            user_cache.put(user_id, snapshot)
+        return snapshot
@@ -4,10 +4,31 @@ from server.extensions import db
 
 
 class AccessLog(db.Model):
+    # On Postgres the table is partitioned by timestamp, on SQLite the rows of earlier periods are moved to
+    # tables access_log_<YYYYMMDD> (see server.log_storage)
     id = db.Column(db.Integer, primary_key=True)
     path = db.Column(db.String(128), nullable=False)
     method = db.Column(db.String(10), nullable=False)
     username = db.Column(db.String(36), nullable=False)
     response_code = db.Column(db.Integer, nullable=False)
     remote_addr = db.Column(db.String(36), nullable=False)
-    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+class AccessLogRollup(db.Model):
+    # Requests per minute, updated by the access log writer with every batch. The path has no host and query.
+    __tablename__ = 'access_log_rollup'
+    minute = db.Column(db.DateTime, primary_key=True)
+    path = db.Column(db.String(128), primary_key=True)
+    method = db.Column(db.String(10), primary_key=True)
+    response_code = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(36), primary_key=True)
+    requests = db.Column(db.Integer, nullable=False)
+
+
+class JobRun(db.Model):
+    # End of the last run of a scheduled job (seconds since the epoch), the Postgres job lock skips runs
+    # more frequent than the minimum interval with it (see server.tasks.job_lock)
+    __tablename__ = 'job_run'
+    name = db.Column(db.String(64), primary_key=True)
+    last_run = db.Column(db.Double, nullable=False)
@@ -1,13 +1,16 @@
 from flask_restful import fields, reqparse
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import object_session
 
-from server.extensions import db
+from server.extensions import db, patient_cache
 from server.utils import parse_timestamp, format_timestamp
 
 
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(68))
-    measures = db.relationship('Measure', backref='category')
+    # The category is joined whenever measures are loaded
+    measures = db.relationship('Measure', backref=db.backref('category', lazy='joined'))
 
     @classmethod
     def get_fields(cls) -> dict:
@@ -16,12 +19,16 @@ class Category(db.Model):
 
 
 class Measure(db.Model):
+    # Series of one category of an appointment in timestamp order, also serves lookups by appointment_id
+    __table_args__ = (db.Index('ix_measure_series', 'appointment_id', 'category_id', '_timestamp',
+                               postgresql_include=['value']),)
+
     id = db.Column(db.Integer, primary_key=True)
     marker = db.Column(db.String(68))
     value = db.Column(db.Float)
     _timestamp = db.Column(db.Float)
     appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=False)
-    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False, index=True)
 
     @property
     def timestamp(self):
@@ -43,9 +50,10 @@ class Measure(db.Model):
 
 class Appointment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False, index=True)
     _date = db.Column(db.Double)
-    measures = db.relationship('Measure', backref='appointment')
+    # Related rows are loaded with one additional SELECT ... IN query per level to avoid N+1 queries
+    measures = db.relationship('Measure', backref='appointment', lazy='selectin')
 
     @property
     def date(self):
@@ -71,7 +79,7 @@ class Patient(db.Model):
     surname = db.Column(db.String(68))
     _birthday = db.Column(db.Double)
     comments = db.Column(db.Text)
-    appointments = db.relationship('Appointment', backref='patient')
+    appointments = db.relationship('Appointment', backref='patient', lazy='selectin')
 
     @property
     def birthday(self):
@@ -107,3 +115,39 @@ class Patient(db.Model):
         parser.add_argument('surname', type=str)
         parser.add_argument('comments', type=str)
         return parser
+
+
+# Cached patient responses include appointments and measures, every change evicts the patient after commit
+def _evict_patients(target, patient_ids: set):
+    session = object_session(target)
+    patient_ids.discard(None)
+    if session is not None and patient_ids:
+        patient_cache.invalidate_after_commit(session, patient_ids)
+
+
+def _with_previous(target, attribute: str) -> set:
+    """Current and previous value of a foreign key, a moved row changes both parents"""
+    return {getattr(target, attribute), *inspect(target).attrs[attribute].history.deleted}
+
+
+@event.listens_for(Patient, 'after_update')
+@event.listens_for(Patient, 'after_delete')
+def _patient_changed(mapper, connection, target):
+    _evict_patients(target, {target.id})
+
+
+@event.listens_for(Appointment, 'after_insert')
+@event.listens_for(Appointment, 'after_update')
+@event.listens_for(Appointment, 'after_delete')
+def _appointment_changed(mapper, connection, target):
+    _evict_patients(target, _with_previous(target, 'patient_id'))
+
+
+@event.listens_for(Measure, 'after_insert')
+@event.listens_for(Measure, 'after_update')
+@event.listens_for(Measure, 'after_delete')
+def _measure_changed(mapper, connection, target):
+    appointment_ids = _with_previous(target, 'appointment_id')
+    patient_ids = connection.execute(select(Appointment.patient_id)
+                                     .where(Appointment.id.in_(appointment_ids))).scalars()
+    _evict_patients(target, set(patient_ids))
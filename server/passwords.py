@@ -0,0 +1,182 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import Flask
+from werkzeug.security import generate_password_hash, check_password_hash
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class PasswordHasherBusy(Exception):
+    """Raised if all password verification slots are in use or a verification could not finish in time"""
+
+
+class PasswordHasher:
+    """Hashes and verifies passwords with a configurable werkzeug method.
+
+    Verifications run in a small process pool. At most PASSWORD_HASH_CONCURRENCY verifications run at the
+    same time over all workers of a host (lock files in the instance folder), further logins are rejected
+    immediately instead of occupying every worker with CPU bound hashing. A slot is held until its hash
+    finished, even if the login gave up waiting for it.
+    """
+
+    def __init__(self, app: Flask = None):
+        self.method = 'scrypt'
+        self.salt_length = 16
+        self.workers = 1
+        self.concurrency = 2
+        self.timeout = 10.0
+        self.slot_dir = None
+        # normalized method with all cost parameters, e.g. scrypt:32768:8:1
+        self.method_prefix = None
+        # metrics
+        self.verifications = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.pool_restarts = 0
+        self.rehashed = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.total_seconds = 0.0
+        self.last_seconds = 0.0
+
+        self._pool = None
+        self._pool_pid = None
+        self._slots = None
+        self._slots_pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask):
+        app.config.setdefault('PASSWORD_HASH_METHOD', 'scrypt')
+        app.config.setdefault('PASSWORD_HASH_SALT_LENGTH', 16)
+        # processes per worker, 0 verifies in the calling thread
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 1)
+        app.config.setdefault('PASSWORD_HASH_CONCURRENCY', 2)
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', 10)
+
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        self.salt_length = int(app.config['PASSWORD_HASH_SALT_LENGTH'])
+        self.workers = int(app.config['PASSWORD_HASH_WORKERS'])
+        self.concurrency = int(app.config['PASSWORD_HASH_CONCURRENCY'])
+        self.timeout = float(app.config['PASSWORD_HASH_TIMEOUT'])
+        self.slot_dir = os.path.join(app.instance_path, 'password_slots')
+        self.method_prefix = generate_password_hash('', self.method, self.salt_length).split('$', 1)[0]
+        app.extensions['password_hasher'] = self
+
+    def hash(self, password: str) -> str:
+        return generate_password_hash(password, self.method, self.salt_length)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """True if the hash was created with another method or other cost parameters"""
+        return self.method_prefix is not None and password_hash.split('$', 1)[0] != self.method_prefix
+
+    def verify(self, password_hash: str, password: str) -> bool:
+        slot = self._acquire_slot()
+        if slot is None:
+            self.rejected += 1
+            raise PasswordHasherBusy()
+
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        start = time.perf_counter()
+        if self.workers <= 0:
+            try:
+                return check_password_hash(password_hash, password)
+            finally:
+                self._finish(slot, start)
+
+        pool = self._get_pool()
+        try:
+            future = pool.submit(check_password_hash, password_hash, password)
+        except BrokenProcessPool:
+            self._finish(slot, start)
+            self._restart_pool(pool)
+            raise PasswordHasherBusy()
+        # The slot is released when the hash finished, not when the login stops waiting
+        future.add_done_callback(lambda _: self._finish(slot, start))
+        try:
+            return future.result(self.timeout)
+        except FutureTimeoutError:
+            self.timeouts += 1
+            raise PasswordHasherBusy()
+        except BrokenProcessPool:
+            # A verifying process died, the pool is replaced for the next logins
+            self._restart_pool(pool)
+            raise PasswordHasherBusy()
+
+    def _finish(self, slot, start: float):
+        duration = time.perf_counter() - start
+        with self._lock:
+            self.in_flight -= 1
+            self.verifications += 1
+            self.total_seconds += duration
+            self.last_seconds = duration
+        self._release_slot(slot)
+
+    def _restart_pool(self, pool: ProcessPoolExecutor):
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+            self._pool_pid = None
+            self.pool_restarts += 1
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # Every (forked) worker needs its own pool, forkserver avoids forking a process with running threads
+        if self._pool_pid != os.getpid():
+            with self._lock:
+                if self._pool_pid != os.getpid():
+                    if 'forkserver' in multiprocessing.get_all_start_methods():
+                        context = multiprocessing.get_context('forkserver')
+                        # the verifying processes only need werkzeug, not the __main__ module of the worker
+                        context.set_forkserver_preload(['werkzeug.security'])
+                    else:
+                        context = multiprocessing.get_context('spawn')
+                    self._pool = ProcessPoolExecutor(self.workers, mp_context=context)
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+    def _get_slots(self) -> list:
+        # File locks belong to the open file, so every process opens its own files
+        if self._slots_pid != os.getpid():
+            with self._lock:
+                if self._slots_pid != os.getpid():
+                    files = [None] * self.concurrency
+                    if fcntl is not None and self.slot_dir is not None:
+                        os.makedirs(self.slot_dir, exist_ok=True)
+                        files = [open(os.path.join(self.slot_dir, f'slot_{index}.lock'), 'a')
+                                 for index in range(self.concurrency)]
+                    self._slots = [(threading.Lock(), file) for file in files]
+                    self._slots_pid = os.getpid()
+        return self._slots
+
+    def _acquire_slot(self):
+        for thread_lock, file in self._get_slots():
+            if not thread_lock.acquire(blocking=False):
+                continue
+            if file is None:
+                return thread_lock, file
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return thread_lock, file
+            except BlockingIOError:
+                thread_lock.release()
+        return None
+
+    @staticmethod
+    def _release_slot(slot):
+        thread_lock, file = slot
+        if file is not None:
+            fcntl.flock(file, fcntl.LOCK_UN)
+        thread_lock.release()
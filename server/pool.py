@@ -0,0 +1,114 @@
+import logging
+import threading
+import time
+
+from flask import Flask
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+class PoolStats:
+    """Connection pool statistics of one engine in this process, exported by server.metrics"""
+
+    # Set by init_pool
+    wait_warning = 0.1
+    logger = logging.getLogger(__name__)
+
+    def __init__(self):
+        self.reset()
+        self._lock = threading.Lock()
+
+    def reset(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.checked_out = 0
+        self.overflow = 0
+        self.checked_out_max = 0
+        self.overflow_max = 0
+
+    def record(self, pool: QueuePool, wait: float, timeout: bool = False):
+        with self._lock:
+            if timeout:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self.checked_out = pool.checkedout()
+            self.checked_out_max = max(self.checked_out_max, self.checked_out)
+            self.overflow = max(pool.overflow(), 0)
+            self.overflow_max = max(self.overflow_max, self.overflow)
+
+        if timeout:
+            self.logger.error("No database connection available after %.3fs (pool size %d, overflow %d)",
+                              wait, pool.size(), pool.overflow())
+        elif wait > self.wait_warning:
+            self.logger.warning("Waited %.3fs for a database connection (%d checked out, overflow %d)",
+                                wait, self.checked_out, pool.overflow())
+
+    def report(self) -> dict:
+        return {'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_total': self.wait_total,
+                'wait_avg': self.wait_total / self.checkouts if self.checkouts else 0.0,
+                'wait_max': self.wait_max,
+                'checked_out': self.checked_out,
+                'checked_out_max': self.checked_out_max,
+                'overflow': self.overflow,
+                'overflow_max': self.overflow_max}
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool recording the time every checkout waits for a connection in its stats"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def recreate(self) -> 'InstrumentedQueuePool':
+        # engine.dispose() replaces the pool, the statistics continue
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except TimeoutError:
+            self.stats.record(self, time.perf_counter() - start, timeout=True)
+            raise
+        self.stats.record(self, time.perf_counter() - start)
+        return connection
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        self.stats.checked_out = self.checkedout()
+        self.stats.overflow = max(self.overflow(), 0)
+
+
+def init_pool(app: Flask):
+    """Uses the instrumented pool for all engines, must be called before db.init_app"""
+    PoolStats.wait_warning = app.config.get('SQLALCHEMY_POOL_WAIT_WARNING', 100) / 1000
+    PoolStats.logger = app.logger
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    if _pooled(app.config.get('SQLALCHEMY_DATABASE_URI')):
+        options.setdefault('poolclass', InstrumentedQueuePool)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    # SQLALCHEMY_ENGINE_OPTIONS only apply to the default engine, binds (replicas) take their options as dict
+    binds = {}
+    for key, bind in (app.config.get('SQLALCHEMY_BINDS') or {}).items():
+        bind = {'url': bind} if isinstance(bind, str) else dict(bind)
+        if _pooled(bind.get('url')):
+            bind.setdefault('poolclass', InstrumentedQueuePool)
+        binds[key] = bind
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+
+def _pooled(uri) -> bool:
+    # In-memory SQLite databases need a static pool
+    return bool(uri) and make_url(uri).database not in (None, '', ':memory:')
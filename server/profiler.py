@@ -0,0 +1,237 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from flask import Flask, has_request_context, request
+from flask_jwt_extended import verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import PyJWTError
+from sqlalchemy import event
+
+# Requests with this header are profiled if they are made by an admin
+PROFILE_HEADER = 'X-Profile'
+# Functions listed in the summary of a profile
+SUMMARY_LINES = 40
+
+
+class ProfilerMiddleware:
+    """WSGI middleware running cProfile for sampled requests and requests forced by an admin"""
+
+    def __init__(self, wsgi_app, profiler: 'RequestProfiler'):
+        self.wsgi_app = wsgi_app
+        self.profiler = profiler
+
+    def __call__(self, environ, start_response):
+        forced = environ.get('HTTP_' + PROFILE_HEADER.upper().replace('-', '_')) not in (None, '', '0')
+        # Everybody else is sampled like requests without the header
+        forced = forced and self.profiler.is_admin(environ)
+        if not forced and (not self.profiler.sample_rate or random.random() >= self.profiler.sample_rate):
+            return self.wsgi_app(environ, start_response)
+        # cProfile only allows one active profiler, concurrent requests are not profiled
+        if not self.profiler.lock.acquire(blocking=False):
+            return self.wsgi_app(environ, start_response)
+
+        # Ids sort by time, the folder is shared by all workers
+        record = {'id': f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{uuid.uuid4().hex[:6]}",
+                  'method': environ.get('REQUEST_METHOD'),
+                  'path': environ.get('PATH_INFO'),
+                  'query': environ.get('QUERY_STRING'),
+                  'forced': forced,
+                  'statements': []}
+        environ['profiler.record'] = record
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            profile.enable()
+            try:
+                body = self.wsgi_app(environ, start_response)
+            finally:
+                profile.disable()
+        except BaseException:
+            self.profiler.lock.release()
+            raise
+        return ProfiledBody(body, profile, lambda: self._finish(profile, record, start))
+
+    def _finish(self, profile: cProfile.Profile, record: dict, start: float):
+        self.profiler.lock.release()
+        record['seconds'] = time.perf_counter() - start
+        self.profiler.save(profile, record)
+
+
+class ProfiledBody:
+    """Response body profiled until its last chunk, the profile ends when it is exhausted or closed"""
+
+    def __init__(self, body, profile: cProfile.Profile, on_finish):
+        self.body = body
+        self.profile = profile
+        self.on_finish = on_finish
+        self._finished = False
+
+    def __iter__(self):
+        iterator = iter(self.body)
+        while True:
+            self.profile.enable()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                self._finish()
+                return
+            finally:
+                self.profile.disable()
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self._finish()
+
+    def _finish(self):
+        if not self._finished:
+            self._finished = True
+            self.on_finish()
+
+
+class RequestProfiler:
+    """Profiles a fraction of the requests (PROFILE_SAMPLE_RATE) and requests of admins sending X-Profile: 1.
+
+    Profiles slower than PROFILE_THRESHOLD milliseconds and all forced ones are written with the SQL statements
+    of the request to PROFILE_FOLDER, only the newest PROFILE_MAX_FILES are kept.
+    """
+
+    def __init__(self, app: Flask = None):
+        self.enabled = False
+        self.sample_rate = 0.0
+        self.threshold = 0.5
+        self.max_files = 100
+        self.folder = None
+        self.lock = threading.Lock()
+        self.logger = None
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask):
+        app.config.setdefault('PROFILE_ENABLED', False)
+        app.config.setdefault('PROFILE_SAMPLE_RATE', 0.01)
+        # in milliseconds
+        app.config.setdefault('PROFILE_THRESHOLD', 500)
+        app.config.setdefault('PROFILE_MAX_FILES', 100)
+        if not app.config.get('PROFILE_FOLDER'):
+            app.config['PROFILE_FOLDER'] = os.path.join(app.instance_path, 'profiles')
+
+        self.enabled = bool(app.config['PROFILE_ENABLED'])
+        self.sample_rate = float(app.config['PROFILE_SAMPLE_RATE'])
+        self.threshold = float(app.config['PROFILE_THRESHOLD']) / 1000
+        self.max_files = int(app.config['PROFILE_MAX_FILES'])
+        self.folder = app.config['PROFILE_FOLDER']
+        self.logger = app.logger
+        self.app = app
+        app.extensions['profiler'] = self
+        if not self.enabled:
+            return
+
+        app.wsgi_app = ProfilerMiddleware(app.wsgi_app, self)
+        app.after_request(self._after_request)
+        db = app.extensions['sqlalchemy']
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+                event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def is_admin(self, environ) -> bool:
+        """True if the access token or the web login of the request belongs to an admin.
+
+        Checked before a forced request is profiled, runs the authentication of the request a second time.
+        """
+        from server.utils import get_user  # server.utils imports the models, which import the extensions
+        with self.app.request_context(environ):
+            try:
+                verify_jwt_in_request(optional=True)
+            except (JWTExtendedException, PyJWTError):
+                return False
+            user = get_user()
+            if user is None and hasattr(self.app, 'login_manager'):
+                from flask_login import current_user
+                user = current_user if current_user.is_authenticated else None
+            return user is not None and user.has_role('admin')
+
+    def save(self, profile: cProfile.Profile, record: dict):
+        if not record['forced'] and record['seconds'] < self.threshold:
+            return
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(SUMMARY_LINES)
+        record['summary'] = summary.getvalue()
+        record['timestamp'] = time.time()
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            profile.dump_stats(os.path.join(self.folder, f"{record['id']}.prof"))
+            with open(os.path.join(self.folder, f"{record['id']}.json"), 'w') as file:
+                json.dump(record, file)
+        except OSError:
+            self.logger.exception("Profile %s could not be written", record['id'])
+            return
+        self._rotate()
+
+    def profiles(self) -> list:
+        """Records of the stored profiles, newest first"""
+        records = []
+        for name in self._names(reverse=True):
+            try:
+                with open(os.path.join(self.folder, f"{name}.json")) as file:
+                    records.append(json.load(file))
+            except (OSError, ValueError):
+                continue
+        return records
+
+    def _names(self, reverse: bool = False) -> list:
+        if not self.folder or not os.path.isdir(self.folder):
+            return []
+        return sorted((name[:-5] for name in os.listdir(self.folder) if name.endswith('.json')), reverse=reverse)
+
+    def _rotate(self):
+        names = self._names()
+        for name in names[:max(len(names) - self.max_files, 0)]:
+            for extension in ('.json', '.prof'):
+                try:
+                    os.remove(os.path.join(self.folder, name + extension))
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def _after_request(response):
+        record = request.environ.get('profiler.record')
+        if record is None:
+            return response
+        from server.utils import get_user  # server.utils imports the models, which import the extensions
+        record['status'] = response.status_code
+        user = get_user()
+        record['username'] = user.username if user is not None else None
+        if record['forced']:
+            response.headers['X-Profile-Id'] = record['id']
+        return response
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and 'profiler.record' in request.environ:
+            conn.info.setdefault('profiler_start', []).append(time.perf_counter())
+
+    @staticmethod
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('profiler_start')
+        if not starts:
+            return
+        duration = time.perf_counter() - starts.pop()
+        if has_request_context():
+            record = request.environ.get('profiler.record')
+            if record is not None:
+                record['statements'].append({'statement': statement, 'seconds': duration,
+                                             'executemany': executemany})
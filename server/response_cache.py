@@ -0,0 +1,132 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from server.generation import FileGeneration
+
+
+class ResponseCache:
+    """Per-worker LRU cache of serialized responses with strong ETags.
+
+    Entries are stored under a key starting with the id of the resource they show, all entries of a
+    resource are evicted together. Evictions bump a generation file shared by the workers, the other
+    workers then clear their whole cache. Settings are read with the given prefix, e.g. PATIENT_CACHE_SIZE.
+    """
+
+    def __init__(self, prefix: str, app: Flask = None):
+        self.prefix = prefix
+        self.enabled = True
+        self.max_size = 1000
+        self.ttl = 300
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # monotonic time of the last eviction or clear
+        self.invalidated_at = 0.0
+
+        self._entries = OrderedDict()
+        self._keys = {}
+        self._generation = None
+        self._info_key = f'{prefix.lower()}_evict'
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask):
+        app.config.setdefault(f'{self.prefix}_ENABLED', True)
+        app.config.setdefault(f'{self.prefix}_SIZE', 1000)
+        # Upper bound in seconds for entries, 0 keeps them until they are evicted
+        app.config.setdefault(f'{self.prefix}_TTL', 300)
+        if not app.config.get(f'{self.prefix}_GENERATION_FILE'):
+            app.config[f'{self.prefix}_GENERATION_FILE'] = os.path.join(app.instance_path,
+                                                                        f'{self.prefix.lower()}.gen')
+
+        self.enabled = bool(app.config[f'{self.prefix}_ENABLED'])
+        self.max_size = int(app.config[f'{self.prefix}_SIZE'])
+        self.ttl = float(app.config[f'{self.prefix}_TTL'])
+        self._generation = FileGeneration(app.config[f'{self.prefix}_GENERATION_FILE'])
+        self.clear()
+        if not event.contains(Session, 'after_commit', self._after_commit):
+            event.listen(Session, 'after_commit', self._after_commit)
+            event.listen(Session, 'after_rollback', self._after_rollback)
+        app.extensions[self.prefix.lower()] = self
+
+    def get(self, key: tuple) -> Optional[tuple]:
+        """Returns (etag, body) of a cached response or None"""
+        if not self.enabled:
+            return None
+        self._check_generation()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry[2] is not None and entry[2] < time.monotonic()):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, key: tuple, body: bytes) -> str:
+        """Caches a response body and returns its etag, key[0] is the id of the resource"""
+        etag = self.etag(body)
+        if not self.enabled:
+            return etag
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (etag, body, expires)
+            self._entries.move_to_end(key)
+            self._keys.setdefault(key[0], set()).add(key)
+            while len(self._entries) > self.max_size:
+                old_key, _ = self._entries.popitem(last=False)
+                self._discard_key(old_key)
+        return etag
+
+    @staticmethod
+    def etag(body: bytes) -> str:
+        return hashlib.sha1(body).hexdigest()
+
+    def invalidate(self, resource_ids: Iterable):
+        """Evicts all responses of the resources here and clears the cache of the other workers"""
+        with self._lock:
+            for resource_id in resource_ids:
+                for key in self._keys.pop(resource_id, ()):
+                    self._entries.pop(key, None)
+                    self.evictions += 1
+            self.invalidated_at = time.monotonic()
+        if self._generation is not None:
+            self._generation.bump()
+
+    def invalidate_after_commit(self, session: Session, resource_ids: Iterable):
+        """Evicts the resources once the transaction of session is committed"""
+        session.info.setdefault(self._info_key, set()).update(resource_ids)
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+            self._keys = {}
+            self.invalidated_at = time.monotonic()
+
+    def _discard_key(self, key: tuple):
+        keys = self._keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys[key[0]]
+
+    def _check_generation(self):
+        if self._generation is not None and self._generation.changed():
+            self.clear()
+
+    def _after_commit(self, session: Session):
+        resource_ids = session.info.pop(self._info_key, None)
+        if resource_ids:
+            self.invalidate(resource_ids)
+
+    def _after_rollback(self, session: Session):
+        session.info.pop(self._info_key, None)
@@ -0,0 +1,137 @@
+import itertools
+import threading
+import time
+from functools import partial
+from typing import Optional
+
+from flask import Flask, current_app, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+
+# Requests which only read and may be served by a replica
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ReplicaRouter:
+    """Round-robin over the replica binds (SQLALCHEMY_BINDS keys starting with replica_).
+
+    A replica is checked with SELECT 1 before it is used and again every check_interval seconds. A replica
+    which fails the check or loses its connection is skipped for retry_interval seconds.
+    """
+
+    def __init__(self, app: Flask = None):
+        self.keys = []
+        self.check_interval = 10.0
+        self.retry_interval = 30.0
+        self.max_lag = 1.0
+        self.reads = {}
+
+        self._next = itertools.count()
+        self._checked_at = {}
+        self._down_until = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask):
+        app.config.setdefault('SQLALCHEMY_REPLICA_CHECK_INTERVAL', 10)
+        app.config.setdefault('SQLALCHEMY_REPLICA_RETRY_INTERVAL', 30)
+        # Seconds a replica may be behind the primary
+        app.config.setdefault('SQLALCHEMY_REPLICA_MAX_LAG', 1)
+
+        self.keys = sorted(key for key in (app.config.get('SQLALCHEMY_BINDS') or {})
+                           if key and key.startswith('replica_'))
+        self.check_interval = float(app.config['SQLALCHEMY_REPLICA_CHECK_INTERVAL'])
+        self.retry_interval = float(app.config['SQLALCHEMY_REPLICA_RETRY_INTERVAL'])
+        self.max_lag = float(app.config['SQLALCHEMY_REPLICA_MAX_LAG'])
+        self.reads = {key: 0 for key in self.keys}
+
+        db = app.extensions['sqlalchemy']
+        with app.app_context():
+            for key in self.keys:
+                event.listen(db.engines[key], 'handle_error', partial(self._handle_error, key))
+        app.extensions['replica_router'] = self
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.keys)
+
+    def choose(self, engines: dict) -> Optional[str]:
+        """Returns the key of the next healthy replica or None if no replica is available"""
+        for _ in range(len(self.keys)):
+            key = self.keys[next(self._next) % len(self.keys)]
+            if self._healthy(key, engines[key]):
+                return key
+        return None
+
+    def mark_down(self, key: str):
+        with self._lock:
+            now = time.monotonic()
+            if self._down_until.get(key, 0) > now:
+                return
+            self._down_until[key] = now + self.retry_interval
+        current_app.logger.warning("Replica %s is not available, reads go to the primary for %ds",
+                                   key, self.retry_interval)
+
+    def _healthy(self, key: str, engine) -> bool:
+        now = time.monotonic()
+        if self._down_until.get(key, 0) > now:
+            return False
+        if now - self._checked_at.get(key, float('-inf')) < self.check_interval:
+            return True
+        self._checked_at[key] = now
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+        except Exception:
+            self.mark_down(key)
+            return False
+        return True
+
+    def _handle_error(self, key: str, context):
+        # Lost connections and failed connects, errors of single statements keep the replica in use
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(key)
+
+
+class RoutingSession(Session):
+    """Session reading from a replica during GET requests.
+
+    Every statement of a read request goes to the same replica. Flushes, DML statements and everything after
+    them stay on the primary until the session ends with the request. Pass bind_arguments={'replica': True}
+    to read a single statement from a replica outside of read requests or {'primary': True} to force the
+    primary.
+    """
+
+    def use_primary(self):
+        """Sends all following statements of this session to the primary"""
+        self.info['primary'] = True
+
+    @property
+    def on_replica(self) -> bool:
+        """True if reads of this session are currently served by a replica"""
+        return self.info.get('replica') is not None and not self.info.get('primary')
+
+    def get_bind(self, mapper=None, clause=None, bind=None, replica=False, primary=False, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or primary or self.info.get('primary'):
+            return engine
+        if self._flushing or (clause is not None and not getattr(clause, 'is_select', False)):
+            self.use_primary()
+            return engine
+
+        engines = self._db.engines
+        router = current_app.extensions.get('replica_router')
+        if router is None or not router.enabled or engine is not engines.get(None):
+            return engine
+        if not replica and not (has_request_context() and request.method in READ_METHODS):
+            return engine
+
+        key = self.info.get('replica')
+        if key is None:
+            key = router.choose(engines)
+            if key is None:
+                return engine
+            self.info['replica'] = key
+        router.reads[key] += 1
+        return engines[key]
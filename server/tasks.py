@@ -0,0 +1,167 @@
+import os
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import Flask
+from sqlalchemy import delete, select, text, or_
+from sqlalchemy.engine import Connection
+
+from server import log_storage
+from server.extensions import db
+from server.models.auth import RefreshToken, AccessToken
+from server.models.log import JobRun
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Statistics of the last token clean-up
+cleanup_stats = {'runs': 0,
+                 'skipped': 0,
+                 'deleted_access_tokens': 0,
+                 'deleted_refresh_tokens': 0,
+                 'last_run': None,
+                 'last_duration': 0.0}
+
+# Statistics of the access log maintenance
+access_log_stats = {'runs': 0,
+                    'skipped': 0,
+                    'created_tables': 0,
+                    'dropped_tables': 0,
+                    'deleted_rollups': 0,
+                    'last_run': None,
+                    'last_duration': 0.0}
+
+
+@contextmanager
+def job_lock(app: Flask, connection: Connection, name: str, min_interval: float = 0):
+    """Yields True if this process may run the job.
+
+    Runs more frequent than min_interval seconds are skipped, the time of the last run is stored where the
+    lock is taken. On Postgres a session advisory lock is held on the connection, so one process runs the job
+    at a time over all hosts, and the time is kept in the job_run table. Otherwise a lock file in the instance
+    folder is used, which also stores the time.
+    """
+    if connection.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+
+        key = zlib.crc32(name.encode())
+        acquired = connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {'key': key}).scalar()
+        connection.commit()
+        if not acquired:
+            yield False
+            return
+        try:
+            last_run = connection.execute(select(JobRun.last_run).where(JobRun.name == name)).scalar()
+            connection.commit()
+            if last_run is not None and time.time() - last_run < min_interval:
+                yield False
+                return
+            yield True
+            statement = insert(JobRun).values(name=name, last_run=time.time())
+            connection.execute(statement.on_conflict_do_update(index_elements=[JobRun.name],
+                                                               set_={'last_run': statement.excluded.last_run}))
+            connection.commit()
+        finally:
+            # A failed run leaves the transaction aborted, the session lock outlives the rollback
+            connection.rollback()
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': key})
+            connection.commit()
+        return
+
+    if fcntl is None:
+        yield True
+        return
+
+    os.makedirs(app.instance_path, exist_ok=True)
+    with open(os.path.join(app.instance_path, f'{name}.lock'), 'a+') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            lock_file.seek(0)
+            last_run = float(lock_file.read() or 0)
+            if time.time() - last_run < min_interval:
+                yield False
+                return
+            yield True
+            lock_file.seek(0)
+            lock_file.truncate()
+            lock_file.write(str(time.time()))
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def delete_chunked(connection: Connection, table, condition, chunk_size: int) -> int:
+    """Deletes rows matching condition in transactions of at most chunk_size rows, returns the number of rows"""
+    deleted = 0
+    while True:
+        ids = select(table.c.id).where(condition).limit(chunk_size).scalar_subquery()
+        result = connection.execute(delete(table).where(table.c.id.in_(ids)))
+        connection.commit()
+        deleted += result.rowcount
+        if result.rowcount < chunk_size:
+            return deleted
+
+
+def clear_expired_tokens(app: Flask):
+    interval = app.config.get('TOKEN_CLEANUP_INTERVAL', 60)
+    chunk_size = app.config.get('TOKEN_CLEANUP_CHUNK_SIZE', 1000)
+    with app.app_context(), db.engine.connect() as connection:
+        with job_lock(app, connection, 'clear_expired_tokens', min_interval=interval / 2) as leader:
+            if not leader:
+                cleanup_stats['skipped'] += 1
+                return
+
+            start = time.perf_counter()
+            now = datetime.utcnow().timestamp()
+            access_tokens = AccessToken.__table__
+            refresh_tokens = RefreshToken.__table__
+            expired_refresh_tokens = select(refresh_tokens.c.id).where(refresh_tokens.c.expire_date < now)
+            # Access tokens first, they reference the refresh tokens (delete-orphan cascade of RefreshToken)
+            deleted_access = delete_chunked(connection, access_tokens,
+                                            or_(access_tokens.c.expire_date < now,
+                                                access_tokens.c.refresh_token_id.in_(expired_refresh_tokens)),
+                                            chunk_size)
+            deleted_refresh = delete_chunked(connection, refresh_tokens, refresh_tokens.c.expire_date < now,
+                                             chunk_size)
+            duration = time.perf_counter() - start
+
+    cleanup_stats['runs'] += 1
+    cleanup_stats['deleted_access_tokens'] += deleted_access
+    cleanup_stats['deleted_refresh_tokens'] += deleted_refresh
+    cleanup_stats['last_run'] = now
+    cleanup_stats['last_duration'] = duration
+    app.logger.info("Deleted %d expired access and %d expired refresh tokens in %.3fs",
+                    deleted_access, deleted_refresh, duration)
+
+
+def maintain_access_log(app: Flask):
+    interval = app.config.get('ACCESS_LOG_MAINTENANCE_INTERVAL', 3600)
+    days = max(int(app.config.get('ACCESS_LOG_PARTITION_DAYS', 1)), 1)
+    retention_days = app.config.get('ACCESS_LOG_RETENTION_DAYS', 90)
+    rollup_retention_days = app.config.get('ACCESS_LOG_ROLLUP_RETENTION_DAYS', 365)
+    with app.app_context(), db.engine.connect() as connection:
+        with job_lock(app, connection, 'maintain_access_log', min_interval=interval / 2) as leader:
+            if not leader:
+                access_log_stats['skipped'] += 1
+                return
+
+            start = time.perf_counter()
+            now = datetime.utcnow()
+            result = log_storage.maintain(connection, now, days, retention_days, rollup_retention_days)
+            duration = time.perf_counter() - start
+
+    access_log_stats['runs'] += 1
+    access_log_stats['created_tables'] += len(result['created'])
+    access_log_stats['dropped_tables'] += len(result['dropped'])
+    access_log_stats['deleted_rollups'] += result['deleted_rollups']
+    access_log_stats['last_run'] = now.timestamp()
+    access_log_stats['last_duration'] = duration
+    app.logger.info("Access log: created %s, dropped %s and deleted %d rollups in %.3fs",
+                    result['created'], result['dropped'], result['deleted_rollups'], duration)
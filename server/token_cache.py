@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+from typing import Optional
+
+from flask import Flask
+
+from server.generation import FileGeneration
+
+
+class TokenCache:
+    """Per-worker cache for the JWT blocklist check.
+
+    Maps a token jti to the id of its refresh token until the token expires and keeps the
+    ids of refresh tokens known to be blocked. Workers share a generation file, every
+    change to a refresh token bumps it and all workers clear their cache.
+    """
+
+    def __init__(self, app: Flask = None):
+        self.enabled = True
+        self.max_size = 10000
+        self.ttl = 300
+        self.hits = 0
+        self.misses = 0
+        # monotonic time of the last clear, also after invalidations of other workers
+        self.cleared_at = 0.0
+
+        self._tokens = {}
+        self._blocked = set()
+        self._generation = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask):
+        app.config.setdefault('TOKEN_CACHE_ENABLED', True)
+        app.config.setdefault('TOKEN_CACHE_SIZE', 10000)
+        # Upper bound in seconds for entries, catches changes made outside the application
+        app.config.setdefault('TOKEN_CACHE_TTL', 300)
+        if not app.config.get('TOKEN_CACHE_GENERATION_FILE'):
+            app.config['TOKEN_CACHE_GENERATION_FILE'] = os.path.join(app.instance_path, 'token_cache.gen')
+
+        self.enabled = bool(app.config['TOKEN_CACHE_ENABLED'])
+        self.max_size = int(app.config['TOKEN_CACHE_SIZE'])
+        self.ttl = float(app.config['TOKEN_CACHE_TTL'])
+        self._generation = FileGeneration(app.config['TOKEN_CACHE_GENERATION_FILE'])
+        self.clear()
+        app.extensions['token_cache'] = self
+
+    def get(self, jti: str) -> Optional[int]:
+        """Returns the refresh token id of a cached token or None"""
+        if not self.enabled:
+            return None
+        self._check_generation()
+        entry = self._tokens.get(jti)
+        if entry is None or entry[1] < time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def is_blocked(self, refresh_token_id: int) -> bool:
+        return refresh_token_id in self._blocked
+
+    def add(self, jti: str, refresh_token_id: int, exp: float, blocked: bool = False):
+        if not self.enabled:
+            return
+        with self._lock:
+            if len(self._tokens) >= self.max_size:
+                self._evict()
+            self._tokens[jti] = (refresh_token_id, min(exp, time.time() + self.ttl))
+            if blocked:
+                self._blocked.add(refresh_token_id)
+
+    def invalidate(self):
+        """Clears the cache of all workers, has to be called after a refresh token changed"""
+        self.clear()
+        if self._generation is not None:
+            self._generation.bump()
+
+    def clear(self):
+        with self._lock:
+            self._tokens = {}
+            self._blocked = set()
+            self.cleared_at = time.monotonic()
+
+    def _check_generation(self):
+        if self._generation is not None and self._generation.changed():
+            self.clear()
+
+    def _evict(self):
+        now = time.time()
+        self._tokens = {jti: entry for jti, entry in self._tokens.items() if entry[1] >= now}
+        # still full, drop the oldest half
+        if len(self._tokens) >= self.max_size:
+            keep = list(self._tokens.items())[len(self._tokens) // 2:]
+            self._tokens = dict(keep)
+            self._blocked = {entry[0] for _, entry in keep} & self._blocked
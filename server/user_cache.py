@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from flask import Flask
+
+from server.generation import FileGeneration
+
+
+class UserCache:
+    """Per-worker LRU cache of user snapshots for the JWT and flask-login user loaders.
+
+    Entries are kept for at most ttl seconds. Changing a user bumps a generation file shared by the workers,
+    the other workers then clear their whole cache.
+    """
+
+    def __init__(self, app: Flask = None):
+        self.enabled = True
+        self.max_size = 1000
+        self.ttl = 60
+        self.hits = 0
+        self.misses = 0
+        # monotonic time of the last invalidation or clear
+        self.invalidated_at = 0.0
+
+        self._entries = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask):
+        app.config.setdefault('USER_CACHE_ENABLED', True)
+        app.config.setdefault('USER_CACHE_SIZE', 1000)
+        # Upper bound in seconds for entries, catches changes made outside the application
+        app.config.setdefault('USER_CACHE_TTL', 60)
+        if not app.config.get('USER_CACHE_GENERATION_FILE'):
+            app.config['USER_CACHE_GENERATION_FILE'] = os.path.join(app.instance_path, 'user_cache.gen')
+
+        self.enabled = bool(app.config['USER_CACHE_ENABLED'])
+        self.max_size = int(app.config['USER_CACHE_SIZE'])
+        self.ttl = float(app.config['USER_CACHE_TTL'])
+        self._generation = FileGeneration(app.config['USER_CACHE_GENERATION_FILE'])
+        self.clear()
+        app.extensions['user_cache'] = self
+
+    def get(self, user_id: int) -> Optional[object]:
+        """Returns the cached snapshot of a user or None"""
+        if not self.enabled:
+            return None
+        self._check_generation()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[1] < time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, user_id: int, snapshot: object):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[user_id] = (snapshot, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        """Evicts a user here and clears the cache of all workers, has to be called after a user changed"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self.invalidated_at = time.monotonic()
+        if self._generation is not None:
+            self._generation.bump()
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+            self.invalidated_at = time.monotonic()
+
+    def _check_generation(self):
+        if self._generation is not None and self._generation.changed():
+            self.clear()
@@ -1,13 +1,22 @@
-from flask import render_template, redirect, url_for, flash, request
+import time
+
+from flask import render_template, redirect, url_for, flash, request, send_from_directory, abort, current_app
 from flask_login import login_required, login_user, logout_user
 from flask_wtf import FlaskForm
+from sqlalchemy import and_, case, func, select
+from sqlalchemy.orm import selectinload
 from wtforms.fields.choices import SelectMultipleField
+from wtforms.fields.datetime import DateTimeLocalField
+from wtforms.fields.numeric import IntegerField
 from wtforms.fields.simple import StringField, PasswordField, SubmitField
-from wtforms.validators import InputRequired, Length, EqualTo
+from wtforms.validators import InputRequired, Length, EqualTo, Optional
+from wtforms.widgets import HiddenInput
 
 from server import utils
-from server.extensions import db, login_manager
-from server.models.auth import Role, User, RefreshToken
+from server.auth.utils import _block_user_tokens, revoke_tokens
+from server.extensions import db, login_manager, token_cache, profiler, user_cache
+from server.models.auth import Role, User, RefreshToken, UserSnapshot
+from server.passwords import PasswordHasherBusy
 from server.user_mng import bp
 from server.user_mng.decorator import role_required_web
 
@@ -24,12 +33,30 @@ class SetPasswordForm(FlaskForm):
     submit = SubmitField('Set Password')
 
 
+class SetRolesForm(FlaskForm):
+    roles = SelectMultipleField('Roles', coerce=int)
+    submit = SubmitField('Set Roles')
+
+
 class NewUserForm(FlaskForm):
     username = StringField('Username', validators=[InputRequired(), Length(min=4, max=20)])
     password = PasswordField('Password', validators=[InputRequired(), Length(min=3)])
     roles = SelectMultipleField('Roles', coerce=int, validators=[InputRequired()])
     submit = SubmitField('Add User')
 
+
+class RevokeTokensForm(FlaskForm):
+    user_id = IntegerField('User', widget=HiddenInput(), validators=[Optional()])
+    issued_before = DateTimeLocalField('Issued before', format='%Y-%m-%dT%H:%M', validators=[Optional()])
+    submit = SubmitField('Block tokens')
+
+
+@bp.before_request
+def use_primary():
+    # Administration shows its own changes immediately, it never reads from a replica
+    db.session().use_primary()
+
+
 @bp.context_processor
 def date_processor():
     def format_date(timestamp: float) -> str:
@@ -44,7 +71,13 @@ def login():
         if form.validate_on_submit():
             user = User.query.filter_by(username=form.username.data).first()
             if user:
-                if user.verify_password(form.password.data):
+                try:
+                    valid = user.verify_password(form.password.data)
+                except PasswordHasherBusy:
+                    flash('Too many logins, try again later.')
+                    return render_template('login.html', form=form), 429, {'Retry-After': '1'}
+                if valid:
+                    db.session.commit()  # stores a rehashed password
                     login_user(user)
                     return redirect(url_for('user_mng.user_management'))
                 else:
@@ -62,9 +95,27 @@ def user_management():
     form = NewUserForm()
     form.roles.choices = [(role.id, role.name) for role in Role.query.order_by(Role.name).all()]
 
-    users = User.query.all()
+    # One page of users with their roles (one SELECT ... IN) and token counts (one grouped query)
+    search = request.args.get('search', '').strip()
+    query = select(User).options(selectinload(User.roles)).order_by(User.username)
+    if search:
+        query = query.where(User.username.startswith(search, autoescape=True))
+    page = db.paginate(query, per_page=current_app.config.get('USER_PAGE_SIZE', 50), error_out=False)
+    token_counts = _token_counts([user.id for user in page.items])
 
-    return render_template('user_management.html', form=form, users=users)
+    return render_template('user_management.html', form=form, page=page, users=page.items,
+                           token_counts=token_counts, search=search, revoke_form=RevokeTokensForm())
+
+
+def _token_counts(user_ids: list) -> dict:
+    """Returns {user_id: (active, total)} refresh tokens of the users"""
+    if not user_ids:
+        return {}
+    active = case((and_(RefreshToken.blocked.isnot(True), RefreshToken.expire_date > time.time()), 1), else_=0)
+    rows = db.session.execute(select(RefreshToken.user_id, func.sum(active), func.count())
+                              .where(RefreshToken.user_id.in_(user_ids))
+                              .group_by(RefreshToken.user_id))
+    return {user_id: (int(active_count or 0), total) for user_id, active_count, total in rows}
 
 
 @bp.route('/delete_user/<int:id>')
@@ -75,6 +126,7 @@ def delete_user(id):
     if user is not None:
         db.session.delete(user)
         db.session.commit()
+        user_cache.invalidate(id)
     flash(f'User {id} deleted')
     return redirect(url_for('user_mng.user_management'))
 
@@ -88,12 +140,34 @@ def set_password(id):
     if form.validate_on_submit():
         user.password = form.new_password.data  # Your method to hash and set the new password
         db.session.commit()
+        user_cache.invalidate(id)
         flash('Password updated successfully')
         return redirect(url_for('user_mng.user_management'))
 
     return render_template('set_password.html', form=form, user=user)
 
 
+@bp.route('/set_roles/<int:id>', methods=['GET', 'POST'])
+@login_required
+@role_required_web("admin")
+def set_roles(id):
+    user = User.query.get_or_404(id)
+    form = SetRolesForm()
+    form.roles.choices = [(role.id, role.name) for role in Role.query.order_by(Role.name).all()]
+    if form.validate_on_submit():
+        user.roles = Role.query.filter(Role.id.in_(form.roles.data)).all()
+        # Roles are part of the access tokens, the user has to login again to receive the new roles
+        _block_user_tokens(user.id)
+        db.session.commit()
+        token_cache.invalidate()
+        user_cache.invalidate(id)
+        flash(f'Roles of {user.username} updated, the user has to login again')
+        return redirect(url_for('user_mng.user_management'))
+
+    form.roles.data = [role.id for role in user.roles]
+    return render_template('set_roles.html', form=form, user=user)
+
+
 @bp.route('/add_user', methods=['POST'])
 @login_required
 @role_required_web("admin")
@@ -112,6 +186,8 @@ def add_user():
             new_user.roles.append(role)
         db.session.add(new_user)
         db.session.commit()
+        # The id may have belonged to a deleted user before
+        user_cache.invalidate(new_user.id)
         flash('User added successfully')
 
     return redirect(url_for('user_mng.user_management'))
@@ -130,8 +206,13 @@ def logout():
 @role_required_web("admin")
 def tokens(id):
     user = User.query.get_or_404(id)
+    # Latest expiry first, served by the (user_id, expire_date) index
+    query = (select(RefreshToken).where(RefreshToken.user_id == id)
+             .order_by(RefreshToken.expire_date.desc(), RefreshToken.id.desc()))
+    page = db.paginate(query, per_page=current_app.config.get('TOKEN_PAGE_SIZE', 50), error_out=False)
 
-    return render_template('tokens.html', user=user)
+    revoke_form = RevokeTokensForm(user_id=id)
+    return render_template('tokens.html', user=user, page=page, tokens=page.items, revoke_form=revoke_form)
 
 
 @bp.route('/token/toggle/<int:user_id>/<int:id>', methods=['GET'])
@@ -141,11 +222,48 @@ def token_toggle(user_id, id):
     token = RefreshToken.query.get_or_404(id)
     token.blocked = not token.blocked
     db.session.commit()
+    token_cache.invalidate()
+
+    return redirect(url_for('user_mng.tokens', id=user_id, page=request.args.get('page', type=int)))
 
-    return redirect(url_for('user_mng.tokens', id=user_id))
+
+@bp.route('/revoke_tokens', methods=['POST'])
+@login_required
+@role_required_web("admin")
+def revoke():
+    # Blocks all tokens of a user (tokens page) or all tokens issued before a time (user management page)
+    form = RevokeTokensForm()
+    valid = form.validate_on_submit()
+    user_id = form.user_id.data if valid else None
+    target = url_for('user_mng.tokens', id=user_id) if user_id else url_for('user_mng.user_management')
+    if not valid or (user_id is None and form.issued_before.data is None):
+        flash('Select the user or the time before which tokens were issued')
+        return redirect(target)
+
+    issued_before = form.issued_before.data.timestamp() if form.issued_before.data else None
+    blocked = revoke_tokens(user_id=user_id, issued_before=issued_before)
+    flash(f'{blocked} tokens blocked')
+    return redirect(target)
+
+
+@bp.route('/profiles', methods=['GET'])
+@login_required
+@role_required_web("admin")
+def profiles():
+    return render_template('profiles.html', profiles=profiler.profiles(), enabled=profiler.enabled)
+
+
+@bp.route('/profiles/<name>', methods=['GET'])
+@login_required
+@role_required_web("admin")
+def profile_download(name):
+    # <id>.prof (pstats, e.g. for snakeviz) or <id>.json (SQL statements and summary)
+    if not name.endswith(('.prof', '.json')) or not profiler.folder:
+        abort(404)
+    return send_from_directory(profiler.folder, name, as_attachment=True)
 
 
 # This function is needed for flask-login to retrieve a user after login
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return UserSnapshot.load(user_id)
@@ -1,21 +1,26 @@
 from datetime import datetime
-from server.models.auth import User
+from server.models.auth import User, UserSnapshot
 from flask import g
 
 
-def get_current_user():
+def get_user():
+    """User of the access token or the web login of this request, None if the request is anonymous"""
     user = g.get("_jwt_extended_jwt_user")
-    current_user = "Anonymous"
     if user is None:
         user = g.get("_login_user")
     else:
         user = user["loaded_user"]
 
-    if not user is None:
-        if isinstance(user, User):
-            current_user = user.username
+    if isinstance(user, (User, UserSnapshot)):
+        return user
+    return None
+
 
-    return current_user
+def get_current_user():
+    user = get_user()
+    if user is None:
+        return "Anonymous"
+    return user.username
 
 
 def parse_timestamp(timestamp_str: str) -> float: